@@ -14,14 +14,19 @@ from threading import Thread
 # Load own modules
 import multiprocessing
 from log.multiprocessinglog import *
+from log.metrics import *
 from ngram.ngram_creator import *
+from ngram.corpus import *
+from ngram.registry import *
+from ngram.guessnumber import *
+from ngram.enumerator import *
+from ngram.smoothing import *
+from ngram.quantize import *
+from ngram.scheduler import *
+from ngram.ensemble import *
 
 # Global variables
-mtlog = MultiProcessingLog('foo.log', 'a', 0, 0)
-logger = logging.getLogger()
-logger.addHandler(mtlog)
-logger.setLevel(logging.DEBUG) # DEBUG, INFO, CRITICAL
-logger = multiprocessing.log_to_stderr(logging.INFO) # DEBUG, INFO, CRITICAL
+logger = setup_logging(logging.DEBUG) # Until the config file is read, then log_level
 
 class Configure:
 
@@ -44,6 +49,53 @@ class Configure:
                 self.NGRAM_SIZE = config.get("ngram_size", 3)
                 self.NO_CPUS = config.get("no_cpus", 8)
                 self.PROGRESS_BAR = config.get("progress_bar", False)
+                self.SINGLE_PASS = config.get("single_pass", False)
+                self.BACKEND = config.get("backend", "list")
+                self.DTYPE = config.get("dtype", "float64")
+                self.MODEL_FORMAT = config.get("model_format", "pack")
+                self.BATCH_SIZE = config.get("batch_size", 0)
+                self.STORAGE = config.get("storage", "dense")
+                self.PARALLEL_COUNTING = config.get("parallel_counting", False)
+                self.SAVE_COUNTS = config.get("save_counts", True)
+                self.SERVER_ADDRESS = config.get("server_address", "127.0.0.1:8765")
+                self.PARALLEL_EVAL = config.get("parallel_eval", False)
+                self.MEMORY_BUDGET_MB = config.get("memory_budget_mb", 0)
+                self.GUESS_SAMPLES = config.get("guess_samples", 0)
+                self.LEVEL_STEP = config.get("level_step", 1.0)
+                self.METRICS_DIR = config.get("metrics_dir", "")
+                self.METRICS_INTERVAL = config.get("metrics_interval", 0)
+                self.SMOOTHING = config.get("smoothing", "")
+                self.SMOOTHING_PARAM = config.get("smoothing_param", None)
+                self.SHARED_CP = config.get("shared_cp", False)
+                self.QUANTIZE_BITS = config.get("quantize_bits", 0)
+                self.TRAINING_MEMORY_MB = config.get("training_memory_mb", 0) # 0: no limit
+                self.ENSEMBLE = config.get("ensemble", []) # Training files of the models that are scored together
+                self.ENSEMBLE_COMBINE = config.get("ensemble_combine", "max")
+                self.INPUT_FORMAT = config.get("input_format", "plain") # plain: one password per line, counted: "count<TAB>password"
+                self.AGGREGATE_INPUT = config.get("aggregate_input", False)
+                self.LOG_LEVEL = config.get("log_level", "DEBUG") # DEBUG, INFO, CRITICAL
+                logging.getLogger().setLevel(self.LOG_LEVEL)
         except Exception as e:
             sys.stderr.write("\x1b[1;%dm" % (31) + "Malformed config file: {}\n".format(e) + "\x1b[0m")
             sys.exit(1)
+
+    # The options of the ngram-object of one length, the only mapping of this config to NGramCreator
+    def ngram_options(self, length, training_file=None, progress_bar=False, name=None):
+        return {
+            "name": self.NAME if name is None else name,
+            "alphabet": self.ALPHABET,
+            "ngram_size": self.NGRAM_SIZE,
+            "training_file": "input/"+(self.TRAINING_FILE if training_file is None else training_file),
+            "length": length,
+            "progress_bar": progress_bar,
+            "backend": self.BACKEND,
+            "dtype": self.DTYPE,
+            "model_format": self.MODEL_FORMAT,
+            "storage": self.STORAGE,
+            "smoothing": self.SMOOTHING,
+            "smoothing_param": self.SMOOTHING_PARAM,
+            "shared_cp": self.SHARED_CP,
+            "quantize_bits": self.QUANTIZE_BITS,
+            "input_format": self.INPUT_FORMAT,
+            "aggregate": self.AGGREGATE_INPUT
+        }
@@ -0,0 +1,47 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+''' This script loads the training and generates password candidates in approximately decreasing probability
+:usage: pypy guess.py [number of guesses] > results/guesses.txt
+'''
+
+# Load external modules
+from configs.configure import *
+import io # buffered output
+import itertools # limit the number of guesses
+
+IO_BUFFER = 1 << 20 # Write in blocks of 1 MiB
+
+''' Loads the training data of one length from disk and prepares its enumerator '''
+def load_enumerator(length):
+    ngram_creator = NGramCreator(CONFIG.ngram_options(length))
+    for kind in ("ip_list", "cp_list", "ep_list"):
+        logging.debug("Length: {} - {} load() ...".format(length, kind))
+        ngram_creator.load(kind)
+    return LevelEnumerator(ngram_creator, CONFIG.LEVEL_STEP)
+
+''' Streams the candidates of all lengths to stdout, stops after limit guesses (None: the whole key space) '''
+def guess(limit=None):
+    enumerators = [load_enumerator(length) for length in CONFIG.LENGTHS]
+    logging.debug("Enumeration started ...")
+    with io.open(sys.stdout.fileno(), 'w', buffering=IO_BUFFER, encoding='utf-8', closefd=False) as fo:
+        for password in itertools.islice(enumerate_candidates(enumerators), limit):
+            fo.write(password + "\n")
+
+def main():
+    try:
+        global CONFIG
+        CONFIG = Configure({"name":"My Config"})
+        guess(int(sys.argv[1]) if len(sys.argv) > 1 else None)
+    except KeyboardInterrupt:
+        sys.stderr.write('User canceled\n')
+        sys.exit(1)
+    except Exception as e:
+        sys.stderr.write("\x1b[1;%dm" % (31) + "Error: {}\n".format(e) + "\x1b[0m")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    sys.stderr.write("{0}: {1:%Y-%m-%d %H:%M:%S}\n\n".format("Start", datetime.datetime.now())) # Keep stdout clean for the guesses
+    sys.stderr.write("Press Ctrl+C to shutdown\n")
+    main()
+    sys.stderr.write("{0}: {1:%Y-%m-%d %H:%M:%S}\n".format("Done", datetime.datetime.now()))
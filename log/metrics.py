@@ -0,0 +1,101 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+''' Counters and phase timers for training and evaluation, written as JSON '''
+
+# External modules
+import os # atomic writes
+import sys # platform
+import json # metrics file
+import time # timers
+import threading # periodic snapshots
+from contextlib import contextmanager # timer()
+
+# Peak resident set size in MB of this process (or of its terminated child processes)
+def peak_rss_mb(children=False):
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0 # macOS: bytes, Linux: KB
+
+'''
+counters: e.g., lines_read, skipped_length, skipped_alphabet, ngrams_counted, passwords_scored
+timers:   seconds per phase, e.g., count, prob, save, load, eval (summed over all calls)
+Updating is cheap, hot loops should still count in local variables and add() once at the end.
+'''
+class Metrics:
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.counters = {}
+        self.timers = {}
+        self.lock = threading.Lock() # Counters are updated by the main thread, read by the snapshot thread
+        self._thread = None
+        self._stop = threading.Event()
+
+    def add(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            self.timers[phase] = self.timers.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.time() - start)
+
+    # Adds the counters and timers of a snapshot, e.g., returned by a worker process
+    def merge(self, snapshot):
+        for counter, value in snapshot.get("counters", {}).items():
+            self.add(counter, value)
+        for phase, seconds in snapshot.get("timers", {}).items():
+            self.add_time(phase, seconds)
+
+    def snapshot(self, **extra):
+        with self.lock:
+            elapsed = time.time() - self.started
+            result = {
+                "name": self.name,
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "elapsed_seconds": elapsed,
+                "counters": dict(self.counters),
+                "timers": dict(self.timers),
+                "peak_rss_mb": peak_rss_mb(),
+                "peak_rss_children_mb": peak_rss_mb(children=True)
+            }
+        if "passwords_scored" in result["counters"] and result["timers"].get("eval"):
+            result["passwords_per_second"] = result["counters"]["passwords_scored"] / result["timers"]["eval"]
+        if "lines_read" in result["counters"] and result["timers"].get("count"):
+            result["lines_per_second"] = result["counters"]["lines_read"] / result["timers"]["count"]
+        result.update(extra)
+        return result
+
+    # Writes the snapshot atomically, a reader never sees a partial file
+    def write(self, path, **extra):
+        temporary = path + ".tmp"
+        with open(temporary, 'w') as fp:
+            json.dump(self.snapshot(**extra), fp, indent=4, sort_keys=True)
+        os.rename(temporary, path)
+
+    # Writes a snapshot every interval seconds until stop()
+    def start(self, path, interval):
+        def run():
+            while not self._stop.wait(interval):
+                self.write(path)
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
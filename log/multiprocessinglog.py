@@ -1,40 +1,44 @@
-from logging.handlers import RotatingFileHandler
-import multiprocessing, threading, logging, sys, traceback
-from rainbow_logging_handler import RainbowLoggingHandler # pip install rainbow_logging_handler
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
 
-class MultiProcessingLog(logging.Handler):
-    def __init__(self, name, mode, maxsize, rotate):
-        logging.Handler.__init__(self)
+''' Logging for the main process and for the processes of a multiprocessing.Pool
+:author: Maximilian Golla
+:contact: maximilian.golla@rub.de
+:version: 0.7.1, 2019-07-11
 
-        #self._handler = RotatingFileHandler(name, mode, maxsize, rotate)
-        formatter = logging.Formatter("[%(asctime)s.%(msecs)03d] %(filename)16s Line %(lineno)3d %(funcName)s():\t %(message)s")
-        self._handler = RainbowLoggingHandler(sys.stderr, color_funcName=('green', 'none', True))
-        self._handler.setFormatter(formatter)
+Without a pool, records are written to stderr directly, no queue and no thread.
+Only while a pool is used (see MultiProcessingLog.pool()), the workers collect
+their records in batches and send them through one queue to a listener thread
+in the parent process, which is the only writer.
+'''
 
-        self.queue = multiprocessing.Queue(-1)
+import multiprocessing, threading, logging, sys, time, traceback
+from multiprocessing.util import Finalize
+from rainbow_logging_handler import RainbowLoggingHandler # pip install rainbow_logging_handler
 
-        t = threading.Thread(target=self.receive)
-        t.daemon = True
-        t.start()
+FORMAT = "[%(asctime)s.%(msecs)03d] %(filename)16s Line %(lineno)3d %(funcName)s():\t %(message)s"
 
-    def setFormatter(self, fmt):
-        logging.Handler.setFormatter(self, fmt)
-        self._handler.setFormatter(fmt)
+''' Writes the records of this process to stderr, records below level are dropped before they are created '''
+def setup_logging(level=logging.DEBUG):
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = RainbowLoggingHandler(sys.stderr, color_funcName=('green', 'none', True))
+    handler.setFormatter(logging.Formatter(FORMAT))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    return logger
 
-    def receive(self):
-        while True:
-            try:
-                record = self.queue.get()
-                self._handler.emit(record)
-            except (KeyboardInterrupt, SystemExit):
-                raise
-            except EOFError:
-                break
-            except:
-                traceback.print_exc(file=sys.stderr)
+# Worker side: collects the records and sends them as one list, on a full batch, after flush_interval seconds (see start()), or on a warning
+class BatchingQueueHandler(logging.Handler):
 
-    def send(self, s):
-        self.queue.put_nowait(s)
+    def __init__(self, queue, batch_size, flush_interval):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batch = []
+        self.oldest = None
 
     def _format_record(self, record):
         # ensure that exc_info and args
@@ -45,20 +49,103 @@ class MultiProcessingLog(logging.Handler):
             record.msg = record.msg % record.args
             record.args = None
         if record.exc_info:
-            dummy = self.format(record)
+            record.msg = "{}\n{}".format(record.msg, logging.Formatter().formatException(record.exc_info))
             record.exc_info = None
-
         return record
 
     def emit(self, record):
         try:
-            s = self._format_record(record)
-            self.send(s)
+            self.batch.append(self._format_record(record))
+            now = time.time()
+            if self.oldest is None:
+                self.oldest = now
+            if len(self.batch) >= self.batch_size or record.levelno >= logging.WARNING or now - self.oldest >= self.flush_interval:
+                self.flush()
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
             self.handleError(record)
 
+    def flush(self):
+        self.acquire()
+        try:
+            if self.batch:
+                self.queue.put(self.batch)
+                self.batch = []
+                self.oldest = None
+        finally:
+            self.release()
+
+    # Timed flush: a record logged right before a long phase is sent after flush_interval seconds, not with the next record
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval / 4.0)
+            oldest = self.oldest
+            if oldest is not None and time.time() - oldest >= self.flush_interval:
+                self.flush()
+
+    def start(self):
+        thread = threading.Thread(target=self._flush_periodically)
+        thread.daemon = True # Finalize() sends the remaining records at the exit
+        thread.start()
+
+# Pool initializer: replaces the inherited stderr handler of the worker by the batching one
+def _init_worker(queue, level, batch_size, flush_interval):
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = BatchingQueueHandler(queue, batch_size, flush_interval)
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    handler.start()
+    Finalize(handler, handler.flush, exitpriority=10) # The remaining records, when the worker exits
+
+'''
+Parent side: a listener thread hands the batches of the workers to the handlers of this process.
+    with MultiProcessingLog() as log:
+        pool = log.pool(processes)
+        ...
+        pool.close()
+        pool.join() # before leaving the block, so the last batches are written
+'''
+class MultiProcessingLog:
+
+    def __init__(self, batch_size=256, flush_interval=1.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = multiprocessing.Queue(-1)
+        self.thread = threading.Thread(target=self.receive)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def receive(self):
+        while True:
+            try:
+                batch = self.queue.get()
+                if batch is None: # close()
+                    break
+                for record in batch:
+                    logger = logging.getLogger(record.name)
+                    if logger.isEnabledFor(record.levelno):
+                        logger.handle(record)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except EOFError:
+                break
+            except:
+                traceback.print_exc(file=sys.stderr)
+
+    ''' A multiprocessing.Pool whose workers log through this listener '''
+    def pool(self, processes):
+        return multiprocessing.Pool(processes=processes, initializer=_init_worker,
+                                    initargs=(self.queue, logging.getLogger().level, self.batch_size, self.flush_interval))
+
     def close(self):
-        self._handler.close()
-        logging.Handler.close(self)
\ No newline at end of file
+        self.queue.put(None)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
@@ -9,88 +9,214 @@
 
 # Load external modules
 from configs.configure import *
+import itertools # chunking the eval file
+import collections # chunks in flight
+import io # buffered streams
+import time # eval timer
 
-''' Loads the training data from disk '''
-def worker(length):
-    ngram_creator = NGramCreator({
-        "name": CONFIG.NAME,
-        "alphabet": CONFIG.ALPHABET,
-        "ngram_size": CONFIG.NGRAM_SIZE,
-        "training_file": "input/"+CONFIG.TRAINING_FILE,
-        "length": length,
-        "progress_bar": CONFIG.PROGRESS_BAR
-    })
-    logging.debug("Thread: {} - ip_list load() ...".format(length))
-    ngram_creator.load("ip_list")
-    logging.debug("Thread: {} - cp_list load() ...".format(length))
-    ngram_creator.load("cp_list")
-    logging.debug("Thread: {} - ep_list load() ...".format(length))
-    ngram_creator.load("ep_list")
-    logging.debug("Thread: {} - Loading done ...".format(length))
-    MARKOV_MODELS.append(ngram_creator)
-
-''' Every length has its own model, we select the correct model for every password '''
-def _select_correct_markov_model(pw_length, markov_models):
-    result = markov_models[0] # Fallback solution, if there is no model for the selected length
-    for model in markov_models:
-        if model.length == pw_length:
-            result = model
-    return result
-
-''' This function manages the password strength evaluation '''
-def eval():
-    # ngram creator
-    global MARKOV_MODELS
-    MARKOV_MODELS = []
-    threads = []
-    for length in CONFIG.LENGTHS:
-        # Using threads is not beneficial, because it's a disk intensive task
-        thread = Thread(target = worker, args = (length,))
-        thread.start()
-        threads.append(thread)
-    # Wait for all threads to finish
-    for thread in threads:
-        thread.join()
-
-    logging.debug("Training loaded from disk ...")
-    logging.debug("Number of Markov models: "+str(len(MARKOV_MODELS)))
-    fo = open("results/"+CONFIG.EVAL_FILE.rstrip('.txt')+"_result.txt", "w")
-    with open("input/"+CONFIG.EVAL_FILE, 'r') as inputfile:
-        for line in inputfile:
-            line = line.rstrip('\r\n')
-             # Determine correct model
-            ngram_creator = _select_correct_markov_model(len(line), MARKOV_MODELS)
-            if len(line) != ngram_creator.length: # Important to prevent generating "passwor", or "iloveyo", or "babygir"
-                sys.stderr.write("\x1b[1;%dm" % (31) + "Info: No Markov model for this length: {} {}\n".format(len(line),line) + "\x1b[0m")
-                fo.write("{} {}\t{}\n".format("Info: No Markov model for this length:", len(line), line))
-                continue
-            if ngram_creator._is_in_alphabet(line): # Filter non-printable
-                ip = line[:ngram_creator.ngram_size-1]
-                ip_prob = ngram_creator.ip_list[ngram_creator._n2iIP(ip)]
-                ep = line[len(line)-(ngram_creator.ngram_size-1):]
-                ep_prob = ngram_creator.ep_list[ngram_creator._n2iIP(ep)]
-                old_pos = 0
-                cp_probs = []
-                for new_pos in range(ngram_creator.ngram_size, len(line)+1, 1):
-                    cp = line[old_pos:new_pos]
-                    cp_probs.append(ngram_creator.cp_list[ngram_creator._n2iCP(cp)])
-                    old_pos += 1
-                pw_prob = ip_prob * ep_prob
-                for cp_prob in cp_probs:
-                    pw_prob = pw_prob * cp_prob
-                fo.write("{}\t{}\n".format(pw_prob,line))
-                fo.flush()
+IO_BUFFER = 1 << 20 # Read and write in blocks of 1 MiB
+METRICS = Metrics("meter")
+
+''' Loads the training data of one length from disk, called by the registry on the first password of that length '''
+def load_model(length):
+    if CONFIG.ENSEMBLE: # One model per training file, scored in one pass
+        return Ensemble([_load_ngram_creator(length, training_file) for training_file in CONFIG.ENSEMBLE], CONFIG.ENSEMBLE_COMBINE)
+    return _load_ngram_creator(length, CONFIG.TRAINING_FILE)
+
+''' Loads the model of one length that was trained on training_file '''
+def _load_ngram_creator(length, training_file):
+    ngram_creator = NGramCreator(CONFIG.ngram_options(length, training_file)) # Without progress bar, nothing to show while loading
+    with METRICS.timer("load"):
+        logging.debug("Length: {} - {} ip_list load() ...".format(length, training_file))
+        ngram_creator.load("ip_list")
+        logging.debug("Length: {} - {} cp_list load() ...".format(length, training_file))
+        ngram_creator.load("cp_list")
+        logging.debug("Length: {} - {} ep_list load() ...".format(length, training_file))
+        ngram_creator.load("ep_list")
+    if CONFIG.QUANTIZE_BITS:
+        logging.info("Length: {} - {} Quantized model, the log-probabilities are off by at most {:.6f}".format(length, training_file, ngram_creator.quantization_error()))
+    logging.debug("Length: {} - {} Loading done ...".format(length, training_file))
+    return ngram_creator
+
+''' Scores a chunk of passwords with the vectorized batch engine, returns the result lines in input order '''
+def _eval_chunk(lines, registry, guess_table=None):
+    results = [None] * len(lines)
+    positions_by_length = {}
+    for position, line in enumerate(lines):
+        positions_by_length.setdefault(len(line), []).append(position)
+    for length, positions in positions_by_length.items():
+        ngram_creator = registry.get(length) # Every length has its own model
+        if ngram_creator is None: # Important to prevent generating "passwor", or "iloveyo", or "babygir"
+            for position in positions:
+                sys.stderr.write("\x1b[1;%dm" % (31) + "Info: No Markov model for this length: {} {}\n".format(length,lines[position]) + "\x1b[0m")
+                results[position] = "{} {}\t{}\n".format("Info: No Markov model for this length:", length, lines[position])
+            continue
+        if isinstance(ngram_creator, Ensemble): # The combined score, then the score of every model
+            combined, scores = ngram_creator.score_batch([lines[position] for position in positions])
+            for position, pw_prob, row in zip(positions, combined.tolist(), scores.tolist()):
+                results[position] = _ensemble_line(lines[position], pw_prob, row)
+            continue
+        scores = ngram_creator.score_batch([lines[position] for position in positions])
+        guesses = guess_table.guess_numbers(scores).tolist() if guess_table is not None else [None] * len(positions)
+        for position, pw_prob, guess in zip(positions, scores.tolist(), guesses):
+            if pw_prob != pw_prob: # NaN: Filter non-printable
+                sys.stderr.write("\x1b[1;%dm" % (31) + "Info: Password contains invalid characters: {}\n".format(lines[position]) + "\x1b[0m")
+                results[position] = "{}\t{}\n".format("Info: Password contains invalid characters:", lines[position])
+            elif guess is not None:
+                results[position] = "{}\t{:.0f}\t{}\n".format(pw_prob,guess,lines[position])
             else:
-                sys.stderr.write("\x1b[1;%dm" % (31) + "Info: Password contains invalid characters: {}\n".format(line) + "\x1b[0m")
-                fo.write("{}\t{}\n".format("Info: Password contains invalid characters:", line))
-                continue
-    fo.close()
+                results[position] = "{}\t{}\n".format(pw_prob,lines[position])
+    return results
+
+'''
+Scores a chunk of passwords password by password, returns the result lines in input order.
+The passwords are grouped by length first, so the registry is asked once per length and chunk,
+not once per password, which would reload evicted models over and over with a small memory_budget_mb.
+'''
+def _eval_lines(lines, registry, guess_table=None):
+    results = [None] * len(lines)
+    positions_by_length = {}
+    for position, line in enumerate(lines):
+        positions_by_length.setdefault(len(line), []).append(position)
+    for length, positions in positions_by_length.items():
+        ngram_creator = registry.get(length) # Every length has its own model
+        for position in positions:
+            results[position] = _eval_line(lines[position], ngram_creator, guess_table)
+    return results
+
+''' Scores a single password with the model of its length (None: no model), returns its result line '''
+def _eval_line(line, ngram_creator, guess_table=None):
+    if ngram_creator is None: # Important to prevent generating "passwor", or "iloveyo", or "babygir"
+        sys.stderr.write("\x1b[1;%dm" % (31) + "Info: No Markov model for this length: {} {}\n".format(len(line),line) + "\x1b[0m")
+        return "{} {}\t{}\n".format("Info: No Markov model for this length:", len(line), line)
+    if isinstance(ngram_creator, Ensemble):
+        return _ensemble_line(line, *ngram_creator.score(line))
+    if ngram_creator._is_in_alphabet(line): # Filter non-printable
+        codes = ngram_creator.encoder.encode(line) # Encode once, then only integer arithmetic
+        pw_prob = ngram_creator._score_indices(ngram_creator._indices(codes))
+        if guess_table is not None:
+            return "{}\t{:.0f}\t{}\n".format(pw_prob,guess_table.guess_number(pw_prob),line)
+        return "{}\t{}\n".format(pw_prob,line)
+    sys.stderr.write("\x1b[1;%dm" % (31) + "Info: Password contains invalid characters: {}\n".format(line) + "\x1b[0m")
+    return "{}\t{}\n".format("Info: Password contains invalid characters:", line)
+
+# The result line of an ensemble: the combined probability, the probability of every model (in the order of ensemble), the password
+def _ensemble_line(line, pw_prob, scores):
+    if pw_prob != pw_prob: # NaN: Filter non-printable
+        sys.stderr.write("\x1b[1;%dm" % (31) + "Info: Password contains invalid characters: {}\n".format(line) + "\x1b[0m")
+        return "{}\t{}\n".format("Info: Password contains invalid characters:", line)
+    return "{}\t{}\t{}\n".format(pw_prob, "\t".join("{}".format(score) for score in scores), line)
+
+# Counts the result lines of a chunk: scored, no model for this length, invalid characters
+def _count_results(result):
+    no_model = 0
+    invalid = 0
+    for line in result:
+        if line.startswith("Info: No Markov"):
+            no_model += 1
+        elif line.startswith("Info: Password contains"):
+            invalid += 1
+    METRICS.add("passwords_read", len(result))
+    METRICS.add("passwords_scored", len(result)-no_model-invalid)
+    METRICS.add("no_model", no_model)
+    METRICS.add("invalid", invalid)
+
+''' Scores one chunk with the loaded models, runs in the main process or in a pool process '''
+def _eval_worker(lines):
+    if CONFIG.BATCH_SIZE > 0:
+        return _eval_chunk(lines, MODELS, GUESS_TABLE)
+    return _eval_lines(lines, MODELS, GUESS_TABLE)
+
+''' Decode stage: reads the passwords in chunks of chunk_size lines '''
+def _read_chunks(inputfile, chunk_size):
+    while True:
+        lines = [line.rstrip('\r\n') for line in itertools.islice(inputfile, chunk_size)]
+        if not lines:
+            break
+        yield lines
+
+'''
+Route, score, and format stage with a pool of NO_CPUS processes, yields the result lines in input order.
+The pool is forked after the models are loaded, so the workers share the parent's tables
+instead of loading or receiving a copy (with model_format "mmap", or the numpy backend, the
+pages stay shared; plain lists are touched by the reference counting and get copied lazily).
+At most two chunks per process are in flight, the memory stays bounded for any eval file size.
+'''
+def _eval_parallel(chunks):
+    with MultiProcessingLog() as log: # Only while the pool is used
+        pool = log.pool(CONFIG.NO_CPUS)
+        pending = collections.deque() # AsyncResults in input order
+        for lines in chunks:
+            pending.append(pool.apply_async(_eval_worker, (lines,)))
+            if len(pending) >= 2 * CONFIG.NO_CPUS:
+                yield pending.popleft().get() # The oldest chunk first, keeps the input order
+        while pending:
+            yield pending.popleft().get()
+        pool.close() # no more tasks can be submitted to the pool
+        pool.join() # wait for the worker processes to exit
+
+# "-" is stdin / stdout, invalid bytes are replaced and filtered as invalid characters
+def _open_stream(path, mode):
+    if path == "-":
+        return io.open((sys.stdin if mode == 'r' else sys.stdout).fileno(), mode, buffering=IO_BUFFER, encoding='utf-8', errors='replace', closefd=False)
+    return io.open(path, mode, buffering=IO_BUFFER, encoding='utf-8', errors='replace')
+
+''' This function manages the password strength evaluation, input_path and output_path may be "-" for stdin / stdout '''
+def eval(input_path=None, output_path=None):
+    # ngram creators, loaded on demand
+    global MODELS, GUESS_TABLE, METRICS
+    METRICS = Metrics("meter")
+    metrics_file = os.path.join(CONFIG.METRICS_DIR, "meter_metrics.json") if CONFIG.METRICS_DIR else None
+    if metrics_file and CONFIG.METRICS_INTERVAL > 0:
+        METRICS.start(metrics_file, CONFIG.METRICS_INTERVAL)
+    MODELS = ModelRegistry(load_model, CONFIG.LENGTHS, CONFIG.MEMORY_BUDGET_MB * 1024 * 1024)
+    GUESS_TABLE = None
+    if CONFIG.ENSEMBLE:
+        if CONFIG.GUESS_SAMPLES > 0:
+            raise Exception("Guess numbers are not supported for an ensemble, please set guess_samples to 0")
+        logging.info("Ensemble of {} models ({}), output: {}, then the probability of every model".format(len(CONFIG.ENSEMBLE), ", ".join(CONFIG.ENSEMBLE), CONFIG.ENSEMBLE_COMBINE))
+    elif CONFIG.GUESS_SAMPLES > 0: # Adds the estimated guess number as a second column
+        expected = {"alphabet": CONFIG.ALPHABET, "ngram_size": CONFIG.NGRAM_SIZE, "lengths": CONFIG.LENGTHS}
+        if CONFIG.SMOOTHING:
+            expected["smoothing"] = smoothing_key(CONFIG.SMOOTHING, CONFIG.SMOOTHING_PARAM)
+        GUESS_TABLE = GuessTable.load(guess_table_path(CONFIG.TRAINING_FILE, CONFIG.NGRAM_SIZE), expected)
+        logging.debug("Guess table loaded ({} samples) ...".format(len(GUESS_TABLE)))
+    if CONFIG.PARALLEL_EVAL: # Load before the pool is forked, so the processes share the models
+        for length in CONFIG.LENGTHS:
+            MODELS.get(length)
+        logging.debug("Training loaded from disk ...")
+    if input_path is None:
+        input_path = "input/"+CONFIG.EVAL_FILE
+    if output_path is None:
+        output_path = "results/"+CONFIG.EVAL_FILE.rstrip('.txt')+"_result.txt"
+    # Vectorized: score batch_size passwords at once, otherwise password by password in chunks of 10,000
+    chunk_size = CONFIG.BATCH_SIZE if CONFIG.BATCH_SIZE > 0 else 10000
+    with _open_stream(input_path, 'r') as inputfile, _open_stream(output_path, 'w') as fo:
+        chunks = _read_chunks(inputfile, chunk_size)
+        if CONFIG.PARALLEL_EVAL: # Shard the eval file across NO_CPUS processes
+            results = _eval_parallel(chunks)
+        else:
+            results = (_eval_worker(lines) for lines in chunks)
+        start = time.time()
+        for result in results:
+            fo.write("".join(result)) # One large write per chunk, no flush per password
+            if metrics_file:
+                _count_results(result)
+        METRICS.add_time("eval", time.time() - start)
+    logging.info("Model registry: {}".format(MODELS.stats()))
+    METRICS.stop()
+    if metrics_file:
+        METRICS.write(metrics_file, registry=MODELS.stats())
+        logging.debug("Metrics written to {}".format(metrics_file))
 
 def main():
     try:
         global CONFIG
         CONFIG = Configure({"name":"My Config"})
-        eval()
+        if len(sys.argv) > 1: # pypy meter.py <input|-> [output|-]
+            eval(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "-")
+        else:
+            eval()
     except KeyboardInterrupt:
         print('User canceled')
         sys.exit(1)
@@ -99,7 +225,8 @@ def main():
         sys.exit(1)
 
 if __name__ == '__main__':
-    print("{0}: {1:%Y-%m-%d %H:%M:%S}\n".format("Start", datetime.datetime.now()))
-    print("Press Ctrl+C to shutdown")
+    status = sys.stderr if len(sys.argv) > 1 else sys.stdout # Keep stdout clean for the results
+    status.write("{0}: {1:%Y-%m-%d %H:%M:%S}\n\n".format("Start", datetime.datetime.now()))
+    status.write("Press Ctrl+C to shutdown\n")
     main()
-    print("{0}: {1:%Y-%m-%d %H:%M:%S}".format("Done", datetime.datetime.now()))
+    status.write("{0}: {1:%Y-%m-%d %H:%M:%S}\n".format("Done", datetime.datetime.now()))
@@ -0,0 +1,162 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+''' Reads the training corpus '''
+
+# External modules
+import os # file size
+import io # decoding compressed streams
+import gzip, bz2 # compressed training files
+try:
+    import lzma # .xz
+except ImportError: # Python 2
+    lzma = None
+import logging # logging debug infos
+from tqdm import tqdm # progress bar while reading the file # pip install tqdm
+
+INPUT_FORMATS = ("plain", "counted")
+
+# The module that decompresses the training file, None for a plain text file
+def _compression(training_file):
+    if training_file.endswith(".gz"):
+        return gzip
+    if training_file.endswith(".bz2"):
+        return bz2
+    if training_file.endswith(".xz"):
+        if lzma is None:
+            raise Exception("Reading .xz files requires Python 3 (lzma): {}".format(training_file))
+        return lzma
+    return None
+
+''' The name of the models of a training file, e.g., "input/rockyou.txt.gz" -> "rockyou" '''
+def corpus_name(training_file):
+    file = os.path.basename(training_file)
+    for extension in (".gz", ".bz2", ".xz"):
+        if file.endswith(extension):
+            file = file[:-len(extension)]
+            break
+    return file[:-4]
+
+''' Whether the training file is gzip, bzip2, or xz compressed, such files can only be read as a stream '''
+def is_compressed(training_file):
+    return _compression(training_file) is not None
+
+''' Opens the training file as text, compressed files (.gz, .bz2, .xz) are decompressed while reading '''
+def open_corpus(training_file):
+    compression = _compression(training_file)
+    if compression is None:
+        return open(training_file)
+    return io.TextIOWrapper(compression.open(training_file, 'rb'), encoding='utf-8', errors='replace') # Invalid bytes are not in the alphabet and get filtered
+
+''' Splits the training file into (start, end) byte ranges of roughly equal size, every range starts at the beginning of a line '''
+def split_corpus(training_file, shards):
+    if is_compressed(training_file):
+        raise Exception("A compressed training file can only be read as a stream, not split into byte ranges (please disable parallel_counting): {}".format(training_file))
+    size = os.path.getsize(training_file)
+    boundaries = [0]
+    with open(training_file, 'rb') as input_file:
+        for shard in range(1, shards):
+            input_file.seek(size * shard // shards)
+            input_file.readline() # Move to the start of the next line
+            boundary = min(input_file.tell(), size)
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    if boundaries[-1] < size or size == 0:
+        boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+# The lines of the whole training file, or only the lines that start within the byte range [start, end)
+def _read_lines(training_file, start=None, end=None):
+    if start is None:
+        with open_corpus(training_file) as input_file:
+            for line in input_file:
+                yield line
+        return
+    with open(training_file, 'rb') as input_file:
+        input_file.seek(start)
+        position = start
+        for line in input_file:
+            if position >= end:
+                break
+            position += len(line)
+            yield line.decode('utf-8', 'replace') # Invalid bytes are not in the alphabet and get filtered
+
+'''
+The (password, weight) pairs of the training file (or the lines that start within the byte range [start, end)):
+    plain:    one password per line, weight 1
+    counted:  "count<TAB>password" per line, or the output of "sort | uniq -c" ("   count password"), weight count
+'''
+def read_corpus(training_file, input_format="plain", start=None, end=None):
+    if input_format == "plain":
+        for line in _read_lines(training_file, start, end):
+            yield line.rstrip('\r\n'), 1
+    elif input_format == "counted":
+        for line in _read_lines(training_file, start, end):
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            stripped = line.lstrip(' ') # uniq -c pads the count
+            digits = len(stripped) - len(stripped.lstrip('0123456789'))
+            if digits == 0 or stripped[digits:digits+1] not in ('\t', ' '):
+                raise Exception("Malformed line in '{}' (required: count<TAB>password): {}".format(training_file, line))
+            yield stripped[digits+1:], int(stripped[:digits])
+    else:
+        raise Exception("Unknown input format given (required: {}): {}".format(", ".join(INPUT_FORMATS), input_format))
+
+'''
+Like read_corpus(), returns (pairs, skipped). aggregate: the passwords are summed up in memory first, so every
+distinct password is counted once with its total weight. Only the passwords with keep(password) are kept, the
+summed weight of the others is returned as skipped.
+'''
+def read_training_lines(training_file, input_format="plain", start=None, end=None, aggregate=False, keep=None):
+    pairs = read_corpus(training_file, input_format, start, end)
+    if not aggregate:
+        return pairs, 0
+    weights = {} # password -> summed weight
+    read = skipped = 0
+    for password, weight in pairs:
+        read += 1
+        if keep is None or keep(password):
+            weights[password] = weights.get(password, 0) + weight
+        else:
+            skipped += weight
+    logging.debug("Aggregated {} lines into {} distinct passwords ({} skipped)".format(read, len(weights), skipped))
+    return list(weights.items()), skipped
+
+''' Streams the training file (or a byte range of it) exactly once and feeds every line to the model of its length (IP, CP, and EP at once), returns the line counters
+    shared_cp: the CP table of the first model is trained from the lines of all lengths (>= ngram_size), the other models only count IP and EP
+    input_format: plain or counted (see read_corpus()), every password counts weight times
+    aggregate: duplicate passwords are summed up in memory first and counted once (see read_training_lines())
+    The progress bar has no total, counting the lines first would be a second scan of the file '''
+def count_corpus(ngram_creators, training_file, progress_bar=False, start=None, end=None, shared_cp=False, input_format="plain", aggregate=False):
+    models = dict((ngram_creator.length, ngram_creator) for ngram_creator in ngram_creators) # length -> model
+    cp_model = ngram_creators[0] if shared_cp else None
+    counted = dict.fromkeys(models, 0) # length -> passwords counted
+    read = skipped_length = skipped_alphabet = cp_only = cp_only_ngrams = 0 # Local counters, cheaper than updating the models for every line
+    logging.debug("Single pass over '{}' ({}) for the lengths: {}{}".format(training_file, "all" if start is None else "bytes {}-{}".format(start, end), sorted(models), ", shared CP" if shared_cp else ""))
+    keep = (lambda line: len(line) >= cp_model.ngram_size) if shared_cp else (lambda line: len(line) in models)
+    pairs, skipped_length = read_training_lines(training_file, input_format, start, end, aggregate, keep)
+    read = skipped_length
+    for line, weight in tqdm(pairs, desc=training_file, total=None, disable=not progress_bar, miniters=1000, unit="pw"):
+        read += weight
+        ngram_creator = models.get(len(line))
+        if ngram_creator is None: # Important to prevent generating "passwor", or "iloveyo", or "babygir"
+            if cp_model is not None and len(line) >= cp_model.ngram_size and cp_model._is_in_alphabet(line): # Still a source of CP statistics
+                cp_model._count_cp(cp_model.encoder.encode(line), weight)
+                cp_only += weight
+                cp_only_ngrams += (len(line)-cp_model.ngram_size+1) * weight
+                continue
+            skipped_length += weight
+            continue
+        if ngram_creator._is_in_alphabet(line): # Filter non-printable
+            ngram_creator._count_line(line, cp_model, weight)
+            counted[ngram_creator.length] += weight
+        else:
+            skipped_alphabet += weight
+    for length, ngram_creator in models.items():
+        ngram_creator.counters["ngrams_counted"] += counted[length] * (length-ngram_creator.ngram_size+3) # IP, all CPs, and EP
+    counters = {"lines_read": read, "skipped_length": skipped_length, "skipped_alphabet": skipped_alphabet}
+    if shared_cp:
+        cp_model.counters["ngrams_counted"] += cp_only_ngrams
+        counters["cp_only_lines"] = cp_only
+    return counters
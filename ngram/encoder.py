@@ -0,0 +1,79 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+''' Maps passwords to alphabet indices and n-grams to list indices '''
+
+# External modules
+try:
+    import numpy as np # optional bulk encoding # pip install numpy
+except ImportError:
+    np = None
+
+class AlphabetEncoder:
+
+    def __init__(self, alphabet):
+        self.alphabet = alphabet
+        self.alphabet_len = len(alphabet)
+        self.alphabet_list = list(alphabet)
+        self.alphabet_set = frozenset(alphabet) # O(1) membership test instead of scanning the alphabet string
+        self.codes = dict((char, index) for index, char in enumerate(alphabet)) # a 0, b 1, c 2
+        # str.translate() replaces every char by the char with the code point of its index, i.e., encodes a whole line in C
+        self.translation = dict((ord(char), index) for index, char in enumerate(alphabet))
+        self.lookup = None # numpy only: code point -> alphabet index, built on first use
+
+    # True, if all chars of the string are in the alphabet
+    def is_valid(self, string):
+        return self.alphabet_set.issuperset(string)
+
+    # Alphabet indices of a (valid) string, e.g., "abc" -> [0, 1, 2]
+    def encode(self, string):
+        if self.alphabet_len <= 256: # One byte per char
+            return bytearray(string.translate(self.translation), 'latin-1')
+        codes = self.codes
+        return [codes[char] for char in string]
+
+    # Alphabet indices -> list index, i.e., the indices interpreted as a number with base alphabet_len
+    def index(self, codes):
+        index = 0
+        for code in codes:
+            index = index * self.alphabet_len + code
+        return index
+
+    # List index -> string of size chars, the inverse of index()
+    def decode_index(self, index, size):
+        chars = []
+        for _ in range(0, size):
+            index, code = divmod(index, self.alphabet_len)
+            chars.append(self.alphabet_list[code])
+        return "".join(reversed(chars))
+
+    # Rolling list indices of all sliding windows of size ngram_size in O(len(codes)), e.g., 3-grams: pas|ass|ssw|swo|wor|ord
+    def ngram_indices(self, codes, ngram_size):
+        modulus = self.alphabet_len ** (ngram_size-1)
+        context = self.index(codes[:ngram_size-1])
+        for pos in range(ngram_size-1, len(codes)):
+            index = context * self.alphabet_len + codes[pos]
+            yield index
+            context = index % modulus # Drop the oldest char
+
+    # numpy only: encodes many strings of the same length at once
+    # Returns a (strings x length) matrix of alphabet indices and a mask of the valid rows, invalid chars are encoded as 0
+    def encode_matrix(self, strings, length):
+        if self.lookup is None:
+            self.lookup = np.full(max(ord(char) for char in self.alphabet)+1, -1, dtype=np.int64)
+            for char, index in self.codes.items():
+                self.lookup[ord(char)] = index
+        code_points = np.frombuffer("".join(strings).encode("utf-32-le"), dtype="<u4").reshape(len(strings), length).astype(np.int64)
+        codes = self.lookup[np.minimum(code_points, len(self.lookup)-1)]
+        codes[code_points >= len(self.lookup)] = -1
+        valid = (codes >= 0).all(axis=1)
+        codes[codes < 0] = 0
+        return codes, valid
+
+    # numpy only: vectorized ngram_indices(), returns a (strings x windows) matrix of list indices
+    def ngram_index_matrix(self, codes, ngram_size):
+        windows = codes.shape[1]-ngram_size+1
+        indices = np.zeros((codes.shape[0], windows), dtype=np.int64)
+        for pos in range(0, ngram_size):
+            indices = indices * self.alphabet_len + codes[:, pos:pos+windows]
+        return indices
@@ -0,0 +1,95 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+''' Scores passwords with several models of the same length in one pass ("Markov: Multi")
+
+The models are trained on different corpora, but share the alphabet and the ngram size,
+thus, also the list indices of a password. A password is encoded once, its IP, CP,
+and EP indices are computed once, and gathered from the tables of every model.
+The per-model probabilities are combined into a single score:
+
+    max   the most pessimistic score, the password is as weak as the best model thinks
+    min   the most optimistic score
+    mean  the arithmetic mean of the probabilities
+'''
+
+# External modules
+try:
+    import numpy as np # batch scoring # pip install numpy
+except ImportError:
+    np = None
+
+COMBINE = ("max", "min", "mean")
+
+''' Combines the probabilities of one password '''
+def combine(scores, method="max"):
+    if method == "max":
+        return max(scores)
+    if method == "min":
+        return min(scores)
+    if method == "mean":
+        return sum(scores) / float(len(scores))
+    raise Exception("Unknown ensemble combination given (required: {}): {}".format(", ".join(COMBINE), method))
+
+'''
+The models of one length, used like a single model by the registry. members is a list of
+loaded ngram-objects in the order of the output columns.
+'''
+class Ensemble:
+
+    def __init__(self, members, method="max"):
+        if not members:
+            raise Exception("An ensemble requires at least one model")
+        if method not in COMBINE:
+            raise Exception("Unknown ensemble combination given (required: {}): {}".format(", ".join(COMBINE), method))
+        first = members[0]
+        for member in members[1:]:
+            if (member.alphabet, member.ngram_size, member.length) != (first.alphabet, first.ngram_size, first.length):
+                raise Exception("The models of an ensemble must share alphabet, ngram size, and length: {} and {}".format(first.training_file, member.training_file))
+        self.members = members
+        self.method = method
+        self.length = first.length
+        self.encoder = first.encoder
+
+    def __len__(self):
+        return len(self.members)
+
+    def _is_in_alphabet(self, string):
+        return self.members[0]._is_in_alphabet(string)
+
+    # Returns (combined probability, [probability of every model]), NaN if the password contains invalid characters
+    def score(self, password):
+        if not self._is_in_alphabet(password):
+            return float('nan'), [float('nan')] * len(self.members)
+        indices = self.members[0]._indices(self.encoder.encode(password)) # Encode once for all models
+        scores = [member._score_indices(indices) for member in self.members]
+        return combine(scores, self.method), scores
+
+    '''
+    Returns (combined, scores): the combined probabilities of a batch of passwords of this length, and a
+    (passwords x models) matrix of the probabilities of every model, rows of invalid passwords are NaN (numpy)
+    '''
+    def score_batch(self, passwords):
+        if np is None:
+            raise Exception("Batch scoring requires numpy # pip install numpy")
+        passwords = list(passwords)
+        if not passwords:
+            return np.empty(0, dtype=np.float64), np.empty((0, len(self.members)), dtype=np.float64)
+        for password in passwords:
+            if len(password) != self.length:
+                raise Exception("Batch contains a password of length {}, but the ensemble has length {}: {}".format(len(password), self.length, password))
+        indices = self.members[0]._batch_indices(passwords) # Encode once for all models
+        scores = np.column_stack([member._score_batch_indices(indices) for member in self.members])
+        if self.method == "max":
+            combined = scores.max(axis=1)
+        elif self.method == "min":
+            combined = scores.min(axis=1)
+        else:
+            combined = scores.mean(axis=1)
+        return combined, scores
+
+    def quantization_error(self):
+        return max(member.quantization_error() for member in self.members)
+
+    def memory_usage(self):
+        return sum(member.memory_usage() for member in self.members)
@@ -0,0 +1,118 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+''' Enumerates password candidates of the trained models in approximately decreasing probability
+
+Levels (a form of binning) as in OMEN (Duermuth et al., ESSoS 2015): every IP, CP,
+and EP probability p is mapped to the level int(-ln(p) / level_step), 0 is the
+most likely level. The level of a password is the sum of the levels of its
+IP, CPs, and EP. For level = 0, 1, 2, ... a depth-first search over the n-gram
+chains emits all passwords with exactly this level. Only the current chain is
+kept in memory, the number of guesses does not matter.
+'''
+
+# External modules
+import math # log-probabilities
+import heapq # merging the lengths
+import array # compact storage of the IP indices
+import logging # logging debug infos
+
+class LevelEnumerator:
+
+    def __init__(self, ngram_creator, level_step=1.0, cache_size=65536):
+        self.model = ngram_creator
+        self.level_step = level_step
+        self.cache_size = cache_size # Number of contexts whose sorted transitions are kept
+        self.alphabet_len = ngram_creator.alphabet_len
+        self.alphabet_list = ngram_creator.alphabet_list
+        self.no_contexts = ngram_creator.no_ip_ngrams
+        self.windows = ngram_creator.length-ngram_creator.ngram_size+1
+        self.transitions = {} # context -> [(level, char), ...] sorted by level
+        self.ip_levels = {} # level -> IP indices of this level
+        for index in range(0, self.no_contexts):
+            level = self._level(ngram_creator.ip_list[index])
+            if level is not None:
+                self.ip_levels.setdefault(level, array.array('Q')).append(index)
+        self.ip_level_list = sorted(self.ip_levels)
+        self.min_cp_level = self._level(_max_prob(ngram_creator.cp_list))
+        self.min_ep_level = self._level(_max_prob(ngram_creator.ep_list))
+        # The highest level any password can have, the enumeration stops there
+        self.max_level = self.ip_level_list[-1] + self.windows * self._level(_min_prob(ngram_creator.cp_list)) + self._level(_min_prob(ngram_creator.ep_list))
+        logging.debug("Length: {} - Levels: 0 to {}".format(ngram_creator.length, self.max_level))
+
+    # Level of a probability, None for probability 0 (never emitted)
+    def _level(self, prob):
+        if prob <= 0.0:
+            return None
+        return int(-math.log(prob) / self.level_step)
+
+    # The successors of a context sorted by level, cached for the most recently used contexts
+    def _transitions(self, context):
+        result = self.transitions.get(context)
+        if result is None:
+            if len(self.transitions) >= self.cache_size: # Bounded memory
+                self.transitions.clear()
+            result = []
+            offset = context * self.alphabet_len
+            for char in range(0, self.alphabet_len):
+                level = self._level(self.model.cp_list[offset + char])
+                if level is not None:
+                    result.append((level, char))
+            result.sort()
+            self.transitions[context] = result
+        return result
+
+    # Depth-first search: extends prefix by the remaining windows, yields the passwords that use up the budget exactly
+    def _chains(self, prefix, context, budget, remaining):
+        if remaining == 0:
+            if self._level(self.model.ep_list[context]) == budget:
+                yield prefix
+            return
+        bound = budget - (remaining-1) * self.min_cp_level - self.min_ep_level # Highest level left for this window
+        for level, char in self._transitions(context):
+            if level > bound: # Sorted, all following transitions are too unlikely as well
+                break
+            for password in self._chains(prefix + self.alphabet_list[char], (context * self.alphabet_len + char) % self.no_contexts, budget-level, remaining-1):
+                yield password
+
+    ''' All passwords of this length whose levels add up to level '''
+    def candidates(self, level):
+        bound = level - self.windows * self.min_cp_level - self.min_ep_level
+        for ip_level in self.ip_level_list:
+            if ip_level > bound:
+                break
+            for index in self.ip_levels[ip_level]:
+                prefix = self.model.encoder.decode_index(index, self.model.ngram_size-1)
+                for password in self._chains(prefix, index, level-ip_level, self.windows):
+                    yield password
+
+    ''' Yields (level, password) for all passwords of this length, level by level '''
+    def __iter__(self):
+        for level in range(0, self.max_level+1):
+            for password in self.candidates(level):
+                yield level, password
+
+# The highest probability of a table (list, numpy array, memoryview, or SparseTable)
+def _max_prob(table):
+    if hasattr(table, "defaults"): # SparseTable: observed values, or the probability of an unseen ngram
+        return max(list(table.values) + list(table.defaults) + [table.fallback])
+    if hasattr(table, "codebook"): # QuantizedTable
+        return table.max()
+    if hasattr(table, "max"): # numpy
+        return float(table.max())
+    return max(table)
+
+# The lowest non-zero probability of a table
+def _min_prob(table):
+    if hasattr(table, "defaults"):
+        return min(prob for prob in list(table.values) + list(table.defaults) + [table.fallback] if prob > 0.0)
+    if hasattr(table, "codebook"):
+        return table.min()
+    if hasattr(table, "min"): # numpy
+        return float(table[table > 0.0].min())
+    return min(prob for prob in table if prob > 0.0)
+
+''' Merges the enumerators of all lengths, yields the passwords of all lengths ordered by level '''
+def enumerate_candidates(enumerators):
+    for level, password in heapq.merge(*enumerators):
+        yield password
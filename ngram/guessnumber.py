@@ -0,0 +1,113 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+''' Monte Carlo estimation of guess numbers from the trained models
+
+Dell'Amico and Filippone, Monte Carlo Strength Evaluation, ACM CCS 2015.
+A model of length L defines a sampling distribution q(pw) = IP * CP * ... * CP
+(IP and every CP row sum to 1), while the meter ranks passwords by the score
+p(pw) = IP * EP * CP * ... * CP. With N samples drawn from q, the number of
+passwords with a higher score than s is estimated by
+
+    rank(s) = sum over all samples i with p_i > s of 1 / (N * q_i)
+
+The estimates of all lengths are added up, because an attacker who guesses in
+the order of the meter tries the passwords of all lengths interleaved.
+'''
+
+# External modules
+from bisect import bisect_right # lookups without numpy
+import logging # logging debug infos
+from ngram.model_file import write_model_file, open_model_file # binary table format
+from ngram.corpus import corpus_name # model names
+try:
+    import numpy as np # sampling # pip install numpy
+except ImportError:
+    np = None
+
+# Path of the guess table of all lengths, e.g., trained/training_guess_table_4.bin
+def guess_table_path(training_file, ngram_size):
+    return 'trained/'+corpus_name(training_file)+'_guess_table_'+str(ngram_size)+'.bin'
+
+''' Draws the given number of passwords from the IP -> CP chain of a model, returns the arrays of their scores p and sampling probabilities q '''
+def sample_model(ngram_creator, samples, seed=None, chunk_size=10000):
+    if np is None:
+        raise Exception("Monte Carlo sampling requires numpy # pip install numpy")
+    random_state = np.random.RandomState(seed)
+    alphabet_len = ngram_creator.alphabet_len
+    no_contexts = ngram_creator.no_ip_ngrams
+    ip_probs = ngram_creator._gather("ip_list", np.arange(no_contexts, dtype=np.int64))
+    ip_cdf = np.cumsum(ip_probs)
+    chars = np.arange(alphabet_len, dtype=np.int64)
+    scores = []
+    probabilities = []
+    for start in range(0, samples, chunk_size):
+        size = min(chunk_size, samples-start)
+        rows = np.arange(size)
+        context = np.minimum(np.searchsorted(ip_cdf, random_state.random_sample(size) * ip_cdf[-1], side='right'), no_contexts-1)
+        ip = ip_probs[context]
+        q = ip
+        cp_probs = []
+        for pos in range(0, ngram_creator.length-ngram_creator.ngram_size+1): # One char per window
+            indices = context[:, None] * alphabet_len + chars # The CP row of every sample
+            row_probs = ngram_creator._gather("cp_list", indices)
+            row_cdf = np.cumsum(row_probs, axis=1)
+            char = np.minimum((row_cdf < (random_state.random_sample(size) * row_cdf[:, -1])[:, None]).sum(axis=1), alphabet_len-1)
+            cp_probs.append(row_probs[rows, char])
+            q = q * cp_probs[-1]
+            context = indices[rows, char] % no_contexts # Drop the oldest char
+        p = ip * ngram_creator._gather("ep_list", context) # Same order of multiplications as meter.py
+        for cp in cp_probs:
+            p = p * cp
+        scores.append(p)
+        probabilities.append(q)
+    return np.concatenate(scores), np.concatenate(probabilities)
+
+'''
+Sorted sample scores with the estimated rank of every score:
+    scores: ascending scores of all samples of all lengths
+    ranks:  ranks[i] = sum of the weights 1 / (N * q) of the samples scores[i:], ranks[-1] = 0
+'''
+class GuessTable:
+
+    def __init__(self, scores, ranks, header=None):
+        self.scores = scores
+        self.ranks = ranks
+        self.header = header or {}
+
+    ''' Builds the table from the (scores, probabilities) of N samples per model '''
+    @classmethod
+    def build(cls, samples, header=None):
+        scores = np.concatenate([sample[0] for sample in samples])
+        weights = np.concatenate([1.0 / (len(sample[1]) * sample[1]) for sample in samples])
+        order = np.argsort(scores, kind='mergesort')
+        ranks = np.zeros(len(scores)+1, dtype=np.float64)
+        ranks[:-1] = np.cumsum(weights[order][::-1])[::-1]
+        return cls(scores[order], ranks, header)
+
+    def __len__(self):
+        return len(self.scores)
+
+    # Estimated guess number of one score: 1 + the estimated number of passwords with a higher score
+    def guess_number(self, score):
+        return self.ranks[bisect_right(self.scores, score)] + 1.0
+
+    # numpy only: guess_number() for an array of scores, NaN stays NaN
+    def guess_numbers(self, scores):
+        scores = np.asarray(scores, dtype=np.float64)
+        result = np.asarray(self.ranks)[np.searchsorted(self.scores, scores, side='right')] + 1.0
+        result[np.isnan(scores)] = np.nan
+        return result
+
+    def save(self, path):
+        write_model_file(path, dict(self.header, kind="guess_table"), [("scores", "<f8", self.scores), ("ranks", "<f8", self.ranks)])
+        logging.debug("Guess table with {} samples stored in {}".format(len(self), path))
+
+    # Maps the table read-only, the header must match the expected values (alphabet, ngram_size, lengths, ...)
+    @classmethod
+    def load(cls, path, expected=None):
+        header, arrays = open_model_file(path, use_numpy=np is not None)
+        for key, value in (expected or {}).items():
+            if header.get(key) != value:
+                raise Exception("Guess table {} does not match the configuration: {} is {}, expected {}".format(path, key, header.get(key), value))
+        return cls(arrays["scores"], arrays["ranks"], header)
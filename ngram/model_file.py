@@ -0,0 +1,129 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+''' Versioned binary model format that can be memory-mapped read-only
+
+Layout of a model file (all integers little-endian):
+
+    0   8 bytes  magic "NEMOMDL\\n"
+    8   uint32   format version
+    12  uint32   length of the JSON header in bytes
+    16  ...      JSON header (alphabet, ngram_size, length, kind, arrays, ...)
+    ..  ...      data section: raw little-endian arrays, each one aligned to 64 bytes
+
+Every entry in header["arrays"] describes one array by its name, dtype, number
+of elements, byte offset within the data section, and CRC32 checksum. Loading
+maps the file into memory, so it is constant-time, pages are read lazily on
+first access, and several processes share the same page-cache copy of the model.
+Requires Python 3 (memoryview.cast).
+'''
+
+# External modules
+import os # file handling
+import sys # byte order
+import json # header
+import mmap # read-only mapping
+import zlib # crc32 checksum
+import array # lists without numpy
+import struct # fixed-size preamble
+try:
+    import numpy as np # optional # pip install numpy
+except ImportError:
+    np = None
+
+MAGIC = b"NEMOMDL\n"
+VERSION = 1
+ALIGNMENT = 64
+
+# dtype -> array/memoryview typecode
+TYPECODES = {
+    "<f8": "d",
+    "<f4": "f",
+    "<u1": "B",
+    "<u2": "H",
+    "<u4": "I",
+    "<u8": "Q",
+    "<i8": "q",
+}
+
+def _padding(offset):
+    return (ALIGNMENT - offset % ALIGNMENT) % ALIGNMENT
+
+# Returns the raw little-endian bytes of a list, array.array, or numpy array
+def _to_bytes(data, dtype):
+    if dtype not in TYPECODES:
+        raise Exception("Unsupported dtype: {} (supported: {})".format(dtype, ", ".join(sorted(TYPECODES))))
+    if np is not None and isinstance(data, np.ndarray):
+        return np.ascontiguousarray(data, dtype=dtype).tobytes()
+    data = array.array(TYPECODES[dtype], data)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tobytes()
+
+''' Writes the header and the named arrays [(name, dtype, data), ...] to path (atomically, via a temporary file) '''
+def write_model_file(path, header, arrays):
+    blobs = []
+    descriptions = []
+    offset = 0 # relative to the start of the data section
+    for name, dtype, data in arrays:
+        blob = _to_bytes(data, dtype)
+        offset += _padding(offset)
+        descriptions.append({"name": name, "dtype": dtype, "count": len(blob) // array.array(TYPECODES[dtype]).itemsize, "offset": offset, "checksum": zlib.crc32(blob) & 0xffffffff})
+        blobs.append(blob)
+        offset += len(blob)
+    encoded = json.dumps(dict(header, arrays=descriptions), sort_keys=True).encode("utf-8")
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as fp:
+        fp.write(MAGIC)
+        fp.write(struct.pack("<II", VERSION, len(encoded)))
+        fp.write(encoded)
+        position = len(MAGIC) + 8 + len(encoded)
+        fp.write(b"\0" * _padding(position)) # The data section starts aligned
+        position = 0
+        for description, blob in zip(descriptions, blobs):
+            fp.write(b"\0" * (description["offset"] - position))
+            fp.write(blob)
+            position = description["offset"] + len(blob)
+    os.rename(temp_path, path) # Readers never see a half-written model
+
+''' Reads the header of a model file, the array offsets are made absolute '''
+def read_model_header(path):
+    with open(path, 'rb') as fp:
+        preamble = fp.read(len(MAGIC) + 8)
+        if preamble[:len(MAGIC)] != MAGIC:
+            raise Exception("Not a NEMO model file: {}".format(path))
+        version, header_len = struct.unpack("<II", preamble[len(MAGIC):])
+        if version != VERSION:
+            raise Exception("Unsupported model file version {} (required: {}): {}".format(version, VERSION, path))
+        header = json.loads(fp.read(header_len).decode("utf-8"))
+    data_start = len(MAGIC) + 8 + header_len
+    data_start += _padding(data_start)
+    for description in header["arrays"]:
+        description["offset"] += data_start
+    return header
+
+''' Maps a model file read-only, returns the header and a dict name -> array (numpy array or memoryview) '''
+def open_model_file(path, use_numpy=False, verify=False):
+    header = read_model_header(path)
+    with open(path, 'rb') as fp:
+        mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) # stays valid after the file is closed
+    arrays = {}
+    for description in header["arrays"]:
+        dtype = description["dtype"]
+        itemsize = array.array(TYPECODES[dtype]).itemsize
+        start = description["offset"]
+        end = start + description["count"] * itemsize
+        if end > len(mapped):
+            raise Exception("Truncated model file, array '{}' is incomplete: {}".format(description["name"], path))
+        if verify and zlib.crc32(memoryview(mapped)[start:end]) & 0xffffffff != description["checksum"]:
+            raise Exception("Checksum mismatch for array '{}': {}".format(description["name"], path))
+        if use_numpy:
+            arrays[description["name"]] = np.frombuffer(mapped, dtype=dtype, count=description["count"], offset=start)
+        elif sys.byteorder == "little":
+            arrays[description["name"]] = memoryview(mapped)[start:end].cast(TYPECODES[dtype])
+        else: # Big-endian machines cannot use the mapping directly, copy and swap instead
+            data = array.array(TYPECODES[dtype])
+            data.frombytes(mapped[start:end])
+            data.byteswap()
+            arrays[description["name"]] = data
+    return header, arrays
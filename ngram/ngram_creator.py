@@ -11,11 +11,24 @@
 from collections import OrderedDict # storing the alphabet
 import os # load and save / file handling
 import umsgpack # load and save # pip install u-msgpack-python
-import math # only pow
 import logging # logging debug infos
 from rainbow_logging_handler import RainbowLoggingHandler # pip install rainbow_logging_handler
 from tqdm import tqdm # progress bar while reading the file # pip install tqdm
 import datetime
+import math # scoring quantized models
+from ngram.model_file import write_model_file, open_model_file # binary model format
+from ngram.encoder import AlphabetEncoder # alphabet and ngram index arithmetic
+from ngram.sparse import SparseTable # only the observed ngrams
+from ngram.smoothing import smooth, smoothing_key # smoothing of the raw counts at load time
+from ngram.quantize import quantize, QuantizedTable # 8- or 16-bit log-probability codes
+from ngram.corpus import INPUT_FORMATS, open_corpus, read_training_lines, corpus_name # compressed and counted training files
+from collections import defaultdict # sparse counts
+try:
+    import numpy as np # optional array backend # pip install numpy
+except ImportError:
+    np = None
+
+_SHARED_TABLES = {} # shared_cp only: path -> (modification time, table), one CP table in memory for all lengths
 
 class NGramCreator:
 
@@ -30,6 +43,7 @@ class NGramCreator:
             self.alphabet_dict[char] = i
             i += 1
         self.alphabet_list = list(self.alphabet)
+        self.encoder = AlphabetEncoder(self.alphabet) # built once, encodes whole lines and generates ngram indices
         logging.debug("Used alphabet: {}".format(self.alphabet))
         self.length = dict['length']
         logging.debug("Model string length: {}".format(self.length))
@@ -37,16 +51,54 @@ class NGramCreator:
         assert self.ngram_size >= 2, "n-gram size < 2 does not make any sense! Your configured n-gram size is {}".format(self.ngram_size)
         logging.debug("NGram size: {}".format(self.ngram_size))
         self.training_file = dict['training_file']
-        self.training_file_lines = sum(1 for line in open(self.training_file))
         self.disable_progress = False if dict['progress_bar'] else True
+        self.input_format = dict.get('input_format', "plain") # plain: one password per line, counted: "count<TAB>password"
+        if self.input_format not in INPUT_FORMATS:
+            raise Exception("Unknown input format given (required: {}): {}".format(", ".join(INPUT_FORMATS), self.input_format))
+        self.aggregate = dict.get('aggregate', False) # Sum up duplicate passwords in memory, then count every distinct password once
+        self._aggregated = None # aggregate only: (pairs, skipped) of this length, reused by the IP, CP, and EP pass
+        self.training_file_lines = None # Total of the progress bar, counted by the first _count(), loading a model never reads the corpus
+        self.backend = dict.get('backend', "list") # list: plain Python lists, numpy: contiguous typed arrays
+        if self.backend not in ("list", "numpy"):
+            raise Exception("Unknown backend given (required: list or numpy): {}".format(self.backend))
+        if self.backend == "numpy" and np is None:
+            raise Exception("The numpy backend requires numpy # pip install numpy")
+        self.dtype = dict.get('dtype', "float64") # numpy only: float64 or float32 probabilities
+        logging.debug("Backend: {} ({})".format(self.backend, self.dtype))
+        self.model_format = dict.get('model_format', "pack") # pack: umsgpack, mmap: binary format in model_file.py
+        if self.model_format not in ("pack", "mmap"):
+            raise Exception("Unknown model format given (required: pack or mmap): {}".format(self.model_format))
+        self.storage = dict.get('storage', "dense") # dense: every possible ngram, sparse: only the observed ngrams
+        if self.storage not in ("dense", "sparse"):
+            raise Exception("Unknown storage given (required: dense or sparse): {}".format(self.storage))
+        logging.debug("Storage: {}".format(self.storage))
+        self.quantize_bits = dict.get('quantize_bits', 0) # 0: full precision, 8 or 16: codes into a codebook of log-probabilities
+        if self.quantize_bits:
+            if self.quantize_bits not in (8, 16):
+                raise Exception("Unsupported quantize_bits (required: 0, 8, or 16): {}".format(self.quantize_bits))
+            if self.model_format != "mmap" or self.storage != "dense":
+                raise Exception("Quantized tables require model_format mmap and storage dense")
+        self.shared_cp = dict.get('shared_cp', False) # One CP table trained from the passwords of all lengths, only IP and EP per length
+        self.smoothing = dict.get('smoothing', "") # "": the add-one smoothed model of train.py, otherwise derived from the raw counts by load()
+        self.smoothing_param = dict.get('smoothing_param', None) # None: the default of the method
+        if self.smoothing:
+            if self.storage != "dense":
+                raise Exception("Smoothing at load time requires storage dense: {}".format(self.smoothing))
+            self.smoothing_key = smoothing_key(self.smoothing, self.smoothing_param) # Validates the method
+            logging.debug("Smoothing: {}".format(self.smoothing_key))
+        self._buffered = self.backend == "numpy" and self.storage == "dense" # numpy arrays are counted in bulk
+        self._pending = {"ip_list": [], "cp_list": [], "ep_list": []} # numpy only: indices not yet added to the counts
+        self._arrays = {} # numpy only: cached array views of the tables for batch scoring
+        self._initial_counts = {} # kind -> smoothing count the table was initialized with
+        self.counters = {"lines_read": 0, "skipped_length": 0, "skipped_alphabet": 0, "ngrams_counted": 0} # Metrics of _count() and count_corpus()
         self.ip_list = []
         self.cp_list = []
         self.ep_list = []
-        self.no_ip_ngrams = int(math.pow(self.alphabet_len, (self.ngram_size-1)))
-        self.no_cp_ngrams = int(math.pow(self.alphabet_len, (self.ngram_size)))
+        self.no_ip_ngrams = self.alphabet_len ** (self.ngram_size-1) # exact, also for large n
+        self.no_cp_ngrams = self.alphabet_len ** self.ngram_size
         self.no_ep_ngrams = self.no_ip_ngrams # save one exponentiation :-P
         logging.debug("len(IP) theo: {}".format(self.no_ip_ngrams))
-        logging.debug("len(CP) theo: {} => {} * {}".format(self.no_cp_ngrams, int(math.pow(self.alphabet_len, (self.ngram_size-1))), self.alphabet_len))
+        logging.debug("len(CP) theo: {} => {} * {}".format(self.no_cp_ngrams, self.no_ip_ngrams, self.alphabet_len))
         logging.debug("len(EP) theo: {}".format(self.no_ep_ngrams))
 
     def __del__(self):
@@ -58,10 +110,7 @@ class NGramCreator:
 ########################################################################################################################
 
     def _is_in_alphabet(self, string):
-        for char in string:
-            if not char in self.alphabet:
-                return False
-        return True
+        return self.encoder.is_valid(string)
 
     # checks whether two floats are equal like 1.0 == 1.0?
     def _is_almost_equal(self, a, b, rel_tol=1e-09, abs_tol=0.0):
@@ -72,82 +121,96 @@ class NGramCreator:
 
     # ngram-to-intial-prob-index
     def _n2iIP(self, ngram):
-        ngram = list(ngram)
-        if self.ngram_size == 5:
-            return ( self.alphabet_len**0 * self.alphabet_dict[ngram[3]] ) + ( self.alphabet_len**1 * self.alphabet_dict[ngram[2]] ) + ( self.alphabet_len**2 * self.alphabet_dict[ngram[1]] ) + ( self.alphabet_len**3 * self.alphabet_dict[ngram[0]] )
-        if self.ngram_size == 4:
-            return ( self.alphabet_len**0 * self.alphabet_dict[ngram[2]] ) + ( self.alphabet_len**1 * self.alphabet_dict[ngram[1]] ) + ( self.alphabet_len**2 * self.alphabet_dict[ngram[0]] )
-        if self.ngram_size == 3:
-            return ( self.alphabet_len**0 * self.alphabet_dict[ngram[1]] ) + ( self.alphabet_len**1 * self.alphabet_dict[ngram[0]] )
-        if self.ngram_size == 2:
-            return ( self.alphabet_len**0 * self.alphabet_dict[ngram[0]] )
+        return self.encoder.index(self.encoder.encode(ngram))
 
     # intial-prob-index-to-ngram
     def _i2nIP(self, index):
-        if self.ngram_size == 5:
-            third, fourth = divmod(index,  self.alphabet_len)
-            second, third = divmod(third,  self.alphabet_len)
-            first, second = divmod(second, self.alphabet_len)
-            return self.alphabet_list[first] + self.alphabet_list[second] + self.alphabet_list[third] + self.alphabet_list[fourth]
-        if self.ngram_size == 4:
-            second, third = divmod(index,  self.alphabet_len)
-            first, second = divmod(second, self.alphabet_len)
-            return self.alphabet_list[first] + self.alphabet_list[second] + self.alphabet_list[third]
-        if self.ngram_size == 3:
-            first, second = divmod(index,  self.alphabet_len)
-            return self.alphabet_list[first] + self.alphabet_list[second]
-        if self.ngram_size == 2:
-            return self.alphabet_list[index]
+        return self.encoder.decode_index(index, self.ngram_size-1)
 
     # ngram-to-conditial-prob-index
     def _n2iCP(self, ngram):
-        ngram = list(ngram)
-        if self.ngram_size == 5:
-            return ( self.alphabet_len**0 * self.alphabet_dict[ngram[4]] ) + ( self.alphabet_len**1 * self.alphabet_dict[ngram[3]] ) + ( self.alphabet_len**2 * self.alphabet_dict[ngram[2]] ) + ( self.alphabet_len**3 * self.alphabet_dict[ngram[1]] ) + ( self.alphabet_len**4 * self.alphabet_dict[ngram[0]] )
-        if self.ngram_size == 4:
-            return ( self.alphabet_len**0 * self.alphabet_dict[ngram[3]] ) + ( self.alphabet_len**1 * self.alphabet_dict[ngram[2]] ) + ( self.alphabet_len**2 * self.alphabet_dict[ngram[1]] ) + ( self.alphabet_len**3 * self.alphabet_dict[ngram[0]] )
-        if self.ngram_size == 3:
-            return ( self.alphabet_len**0 * self.alphabet_dict[ngram[2]] ) + ( self.alphabet_len**1 * self.alphabet_dict[ngram[1]] ) + ( self.alphabet_len**2 * self.alphabet_dict[ngram[0]] )
-        if self.ngram_size == 2:
-            return ( self.alphabet_len**0 * self.alphabet_dict[ngram[1]] ) + ( self.alphabet_len**1 * self.alphabet_dict[ngram[0]] )
+        return self.encoder.index(self.encoder.encode(ngram))
 
     # conditial-prob-index-to-ngram
     def _i2nCP(self, index):
-        if self.ngram_size == 5:
-            fourth, fifth = divmod(index,  self.alphabet_len)
-            third, fourth = divmod(fourth, self.alphabet_len)
-            second, third = divmod(third,  self.alphabet_len)
-            first, second = divmod(second, self.alphabet_len)
-            return self.alphabet_list[first] + self.alphabet_list[second] + self.alphabet_list[third] + self.alphabet_list[fourth] + self.alphabet_list[fifth]
-        if self.ngram_size == 4:
-            third, fourth = divmod(index,  self.alphabet_len)
-            second, third = divmod(third,  self.alphabet_len)
-            first, second = divmod(second, self.alphabet_len)
-            return self.alphabet_list[first] + self.alphabet_list[second] + self.alphabet_list[third] + self.alphabet_list[fourth]
-        if self.ngram_size == 3:
-            second, third = divmod(index,  self.alphabet_len)
-            first, second = divmod(second, self.alphabet_len)
-            return self.alphabet_list[first] + self.alphabet_list[second] + self.alphabet_list[third]
-        if self.ngram_size == 2:
-            first, second = divmod(index,  self.alphabet_len)
-            return self.alphabet_list[first] + self.alphabet_list[second]
+        return self.encoder.decode_index(index, self.ngram_size)
 
 ########################################################################################################################
 
+    # Allocates a table for all possible combinations of ngrams filled with the initial count
+    def _new_table(self, size, fill):
+        if self.storage == "sparse": # Raw counts of the observed ngrams only, smoothing is applied in _prob()
+            return defaultdict(int)
+        if self.backend == "numpy":
+            return np.full(size, fill, dtype=np.uint32)
+        return [fill] * size
+
     # Adds all possible combinations of ngrams to the list with initial count = 1
-    def _init_lists(self, kind):
+    # Partial counts (e.g., of a shard of the training file) start with initial_count = 0, the smoothing is added once when merging
+    def _init_lists(self, kind, initial_count=1):
+        self._initial_counts[kind] = initial_count
         if kind == "ip_list":
-            for i in range(0, int(math.pow(self.alphabet_len, self.ngram_size-1))):
-                self.ip_list.append(1) # Smoothing, we initialize every possible ngram with count = 1
+            self.ip_list = self._new_table(self.no_ip_ngrams, initial_count) # Smoothing, we initialize every possible ngram with count = 1
         elif kind == "cp_list":
-            for i in range(0, int(math.pow(self.alphabet_len, self.ngram_size))):
-                self.cp_list.append(1) # Smoothing, we initialize every possible ngram with count = 1
+            self.cp_list = self._new_table(self.no_cp_ngrams, initial_count) # Smoothing, we initialize every possible ngram with count = 1
         elif kind == "ep_list":
-            for i in range(0, int(math.pow(self.alphabet_len, self.ngram_size-1))):
-                self.ep_list.append(1) # Smoothing, we initialize every possible ngram with count = 1
+            self.ep_list = self._new_table(self.no_ep_ngrams, initial_count) # Smoothing, we initialize every possible ngram with count = 1
         else:
             raise Exception('Unknown list given (required: ip_list, cp_list, or ep_list)')
 
+    # The (partial) counts in a compact form for merging: numpy arrays as they are, otherwise a dict index -> count of the observed ngrams
+    def _export_counts(self, kind):
+        if self._buffered:
+            self._flush_counts(kind)
+        table = getattr(self, kind)
+        if self.backend == "numpy" and self.storage == "dense":
+            return table
+        if self.storage == "sparse":
+            return dict(table)
+        return dict((index, count) for index, count in enumerate(table) if count)
+
+    # Adds (partial) counts, as returned by _export_counts(), to this model's counts
+    def _merge_counts(self, kind, counts):
+        if self._buffered:
+            self._flush_counts(kind)
+        table = getattr(self, kind)
+        if np is not None and isinstance(counts, np.ndarray):
+            table += counts # Summing arrays
+        elif isinstance(counts, tuple): # (keys, counts) of the observed ngrams, e.g., from load_counts()
+            keys, counts = counts
+            if self._buffered:
+                table[np.asarray(keys, dtype=np.int64)] += np.asarray(counts, dtype=np.uint32)
+            else:
+                for index, count in zip(keys, counts):
+                    table[index] += count
+        else:
+            for index, count in counts.items():
+                table[index] += count
+
+    # numpy only: adds the buffered ngram indices to the counts in one go
+    def _flush_counts(self, kind):
+        pending = self._pending[kind]
+        if not pending:
+            return
+        table = getattr(self, kind)
+        indices = np.asarray(pending, dtype=np.int64)
+        if len(table) <= 4 * len(indices): # Small table, e.g., IP/EP: one dense bincount
+            table += np.bincount(indices, minlength=len(table)).astype(np.uint32)
+        else: # Huge table, e.g., CP: only touch the observed ngrams
+            unique_indices, counts = np.unique(indices, return_counts=True)
+            table[unique_indices] += counts.astype(np.uint32)
+        del pending[:]
+
+    # Increase the count of one ngram by weight (1 per line, the count of a counted or aggregated password), the numpy backend buffers the increments by 1
+    def _increment(self, kind, index, weight=1):
+        if self._buffered and weight == 1:
+            self._pending[kind].append(index)
+            if len(self._pending[kind]) >= 1048576:
+                self._flush_counts(kind)
+        else:
+            table = getattr(self, kind)
+            table[index] += weight
+
 ########################################################################################################################
 
     # Count the occurrences of ngrams in the training corpus
@@ -163,43 +226,104 @@ class NGramCreator:
           rd EP
     '''
     def _count(self, kind):
-        if kind == "ip_list":
-            with open(self.training_file) as input_file:
-                for line in tqdm(input_file, desc=self.training_file, total=self.training_file_lines, disable=self.disable_progress, miniters=1000, unit="pw"):
-                    line = line.rstrip('\r\n')
-                    if len(line) != self.length: # Important to prevent generating "passwor", or "iloveyo", or "babygir"
-                        continue
-                    if self._is_in_alphabet(line): # Filter non-printable
-                        ngram = line[0:self.ngram_size-1] # Get IP ngram
-                        self.ip_list[self._n2iIP(ngram)] = self.ip_list[self._n2iIP(ngram)] + 1 # Increase IP ngram count by 1
-        elif kind == "cp_list":
-            with open(self.training_file) as input_file: # Open trainingfile
-                for line in tqdm(input_file, desc=self.training_file, total=self.training_file_lines, disable=self.disable_progress, miniters=1000, unit="pw"):
-                    line = line.rstrip('\r\n')
-                    if len(line) != self.length: # Important to prevent generating "passwor", or "iloveyo", or "babygir"
-                        continue
-                    if self._is_in_alphabet(line): # Filter non-printable
-                        old_pos = 0
-                        for new_pos in range(self.ngram_size, len(line)+1, 1): # Sliding window: pas|ass|ssw|swo|wor|ord
-                            ngram = line[old_pos:new_pos]
-                            old_pos += 1
-                            self.cp_list[self._n2iCP(ngram)] = self.cp_list[self._n2iCP(ngram)] + 1 # Increase CP ngram count by 1
-        elif kind == "ep_list":
-            with open(self.training_file) as input_file: # Open trainingfile
-                for line in tqdm(input_file, desc=self.training_file, total=self.training_file_lines, disable=self.disable_progress, miniters=1000, unit="pw"):
-                    line = line.rstrip('\r\n')
-                    if len(line) != self.length: # Important to prevent generating "passwor", or "iloveyo", or "babygir"
-                        continue
-                    if self._is_in_alphabet(line): # Filter non-printable
-                        ngram = line[-self.ngram_size+1:] # Get EP ngram
-                        self.ep_list[self._n2iIP(ngram)] = self.ep_list[self._n2iIP(ngram)] + 1 # Increase EP ngram count by 1
-        else:
+        if kind not in ("ip_list", "cp_list", "ep_list"):
             raise Exception("Unknown dictionary given (required: ip_list, cp_list, or ep_list)")
+        if self.training_file_lines is None and not self.disable_progress and not self.aggregate: # A full scan of the corpus, only while training
+            self.training_file_lines = sum(1 for line in open_corpus(self.training_file))
+        pairs, skipped_length = self._training_lines()
+        read = skipped_length # Local counters, added to self.counters at the end
+        skipped_alphabet = counted = 0
+        for line, weight in tqdm(pairs, desc=self.training_file, total=self.training_file_lines, disable=self.disable_progress, miniters=1000, unit="pw"):
+            read += weight
+            if len(line) != self.length: # Important to prevent generating "passwor", or "iloveyo", or "babygir"
+                skipped_length += weight
+                continue
+            if not self._is_in_alphabet(line): # Filter non-printable
+                skipped_alphabet += weight
+                continue
+            counted += weight
+            if kind == "ip_list":
+                ngram = line[0:self.ngram_size-1] # Get IP ngram
+                self._increment("ip_list", self._n2iIP(ngram), weight) # Increase IP ngram count by weight
+            elif kind == "cp_list":
+                for index in self.encoder.ngram_indices(self.encoder.encode(line), self.ngram_size): # Sliding window: pas|ass|ssw|swo|wor|ord
+                    self._increment("cp_list", index, weight) # Increase CP ngram count by weight
+            else:
+                ngram = line[-self.ngram_size+1:] # Get EP ngram
+                self._increment("ep_list", self._n2iIP(ngram), weight) # Increase EP ngram count by weight
+        self.counters["lines_read"] += read
+        self.counters["skipped_length"] += skipped_length
+        self.counters["skipped_alphabet"] += skipped_alphabet
+        self.counters["ngrams_counted"] += counted * (self.length-self.ngram_size+1 if kind == "cp_list" else 1)
+        if self._buffered:
+            self._flush_counts(kind)
+
+    # The (password, weight) pairs of the training file and the weight skipped by the aggregation, which only keeps this length (once for all passes)
+    def _training_lines(self):
+        if not self.aggregate:
+            return read_training_lines(self.training_file, self.input_format)
+        if self._aggregated is None:
+            self._aggregated = read_training_lines(self.training_file, self.input_format, aggregate=True, keep=lambda line: len(line) == self.length)
+        return self._aggregated
+
+    # Count IP, all CPs, and EP of a single line at once (the line must already be filtered by length and alphabet)
+    # shared_cp: the CPs are counted in the table of cp_model, the model that owns the shared CP table
+    # weight: the number of occurrences of the line, e.g., of a counted or aggregated password
+    def _count_line(self, line, cp_model=None, weight=1):
+        codes = self.encoder.encode(line) # Encode once, then only integer arithmetic
+        self._increment("ip_list", self.encoder.index(codes[:self.ngram_size-1]), weight) # Increase IP ngram count by weight
+        (cp_model or self)._count_cp(codes, weight)
+        self._increment("ep_list", self.encoder.index(codes[-self.ngram_size+1:]), weight) # Increase EP ngram count by weight
+
+    # Count all CPs of an encoded line, shared_cp: also lines of lengths without IP and EP
+    def _count_cp(self, codes, weight=1):
+        for index in self.encoder.ngram_indices(codes, self.ngram_size): # Sliding window: pas|ass|ssw|swo|wor|ord
+            self._increment("cp_list", index, weight) # Increase CP ngram count by weight
 
 ########################################################################################################################
 
+    # numpy only: vectorized version of _prob()
+    def _prob_numpy(self, kind):
+        if kind not in ("ip_list", "cp_list", "ep_list"):
+            raise Exception("Unknown dictionary given (required: ip_dict, cp_dict, or ep_dict)")
+        self._flush_counts(kind)
+        table = getattr(self, kind)
+        if kind == "cp_list":
+            # One row per ngram-1 context, every row is normalized by its own sum
+            rows = table.reshape(-1, self.alphabet_len)
+            probs = np.empty(rows.shape, dtype=self.dtype)
+            np.divide(rows, rows.sum(axis=1, keepdims=True, dtype=np.float64), out=probs, casting='same_kind')
+            self.cp_list = probs.reshape(-1)
+        else:
+            probs = np.empty(len(table), dtype=self.dtype)
+            np.divide(table, table.sum(dtype=np.float64), out=probs, casting='same_kind')
+            setattr(self, kind, probs)
+            sum = probs.sum(dtype=np.float64)
+            logging.debug("{} probability sum: {:.16f}".format(kind[:2].upper(), sum))
+            if not self._is_almost_equal(sum, 1.0, rel_tol=1e-06 if self.dtype == "float32" else 1e-09):
+                raise Exception("{} probabilities do not sum up to 1.0! It is only: {}".format(kind, sum))
+
+    # sparse only: add-one smoothing of the observed counts, yields the same probabilities as the dense lists
+    def _prob_sparse(self, kind):
+        if kind == "cp_list":
+            self.cp_list = SparseTable.from_counts(self.cp_list, self.alphabet_len, self.no_cp_ngrams) # normalized per ngram-1 context
+            logging.debug("CP observed ngrams: {} of {}".format(len(self.cp_list.keys), self.no_cp_ngrams))
+        elif kind in ("ip_list", "ep_list"):
+            table = SparseTable.from_counts(getattr(self, kind), self.no_ip_ngrams, self.no_ip_ngrams) # a single block
+            setattr(self, kind, table)
+            sum = table.block_sum()
+            logging.debug("{} probability sum: {:.16f}".format(kind[:2].upper(), sum))
+            if not self._is_almost_equal(sum, 1.0):
+                raise Exception("{} probabilities do not sum up to 1.0! It is only: {}".format(kind, sum))
+        else:
+            raise Exception("Unknown dictionary given (required: ip_dict, cp_dict, or ep_dict)")
+
     # Determine the probability (based on the counts) of a ngram
     def _prob(self, kind):
+        if self.storage == "sparse":
+            return self._prob_sparse(kind)
+        if self.backend == "numpy":
+            return self._prob_numpy(kind)
         if kind == "ip_list":
             no_ip_training_ngrams = 0.0 # must be a float
             for ngram_count in self.ip_list:
@@ -245,6 +369,106 @@ class NGramCreator:
         else:
             raise Exception("Unknown dictionary given (required: ip_dict, cp_dict, or ep_dict)")
 
+########################################################################################################################
+
+    # numpy only: the table as a numpy array, lists are converted once and cached, mapped tables are wrapped without a copy
+    def _as_array(self, kind):
+        table = getattr(self, kind)
+        if isinstance(table, np.ndarray):
+            return table
+        cached = self._arrays.get(kind)
+        if cached is None or cached[0] is not table:
+            cached = (table, np.asarray(table, dtype=np.float64))
+            self._arrays[kind] = cached
+        return cached[1]
+
+    # numpy only: the probabilities of an array of list indices
+    def _gather(self, kind, indices):
+        table = getattr(self, kind)
+        if isinstance(table, (SparseTable, QuantizedTable)):
+            return table.take(indices)
+        return self._as_array(kind)[indices].astype(np.float64)
+
+    # numpy only: the log-probabilities of an array of list indices, quantized tables are decoded without exp() and log()
+    def _gather_log(self, kind, indices):
+        table = getattr(self, kind)
+        if isinstance(table, QuantizedTable):
+            return table.take_log(indices)
+        with np.errstate(divide='ignore'):
+            return np.log(self._gather(kind, indices))
+
+    # Upper bound of the absolute error of the log-probability of a password caused by the quantization (0.0: full precision)
+    def quantization_error(self):
+        if not self.quantize_bits:
+            return 0.0
+        return self.ip_list.max_error + (self.length-self.ngram_size+1) * self.cp_list.max_error + self.ep_list.max_error
+
+    # Estimate the probabilities of many passwords of this model's length at once
+    # Returns a numpy array with one probability (or log-probability) per password, NaN if it contains invalid characters
+    def score_batch(self, passwords, log=False):
+        if np is None:
+            raise Exception("Batch scoring requires numpy # pip install numpy")
+        passwords = list(passwords)
+        if not passwords:
+            return np.empty(0, dtype=np.float64)
+        for password in passwords:
+            if len(password) != self.length:
+                raise Exception("Batch contains a password of length {}, but the model has length {}: {}".format(len(password), self.length, password))
+        return self._score_batch_indices(self._batch_indices(passwords), log)
+
+    # numpy only: the list indices (ip_index, ep_index, cp_index, valid) of a batch of passwords of this length, shared by the models with the same alphabet and ngram_size
+    def _batch_indices(self, passwords):
+        # Encode the whole batch to a (passwords x length) matrix of alphabet indices, invalid rows are NaN'ed by _score_batch_indices()
+        codes, valid = self.encoder.encode_matrix(passwords, self.length)
+        # Rolling base arithmetic: index = ((c0 * A + c1) * A + c2) ...
+        ip_index = self.encoder.ngram_index_matrix(codes[:, :self.ngram_size-1], self.ngram_size-1)[:, 0]
+        ep_index = self.encoder.ngram_index_matrix(codes[:, -self.ngram_size+1:], self.ngram_size-1)[:, 0]
+        cp_index = self.encoder.ngram_index_matrix(codes, self.ngram_size)
+        return ip_index, ep_index, cp_index, valid
+
+    # numpy only: the probabilities (or log-probabilities) of a batch from its list indices, see _batch_indices()
+    def _score_batch_indices(self, indices, log=False):
+        ip_index, ep_index, cp_index, valid = indices
+        windows = self.length-self.ngram_size+1 # Sliding window: pas|ass|ssw|swo|wor|ord
+        if self.quantize_bits: # Sum the decoded log-probabilities, no underflow
+            result = self._gather_log("ip_list", ip_index) + self._gather_log("ep_list", ep_index) + self._gather_log("cp_list", cp_index).sum(axis=1)
+            if not log:
+                result = np.exp(result)
+            result[~valid] = np.nan
+            return result
+        # Gather all probabilities in one shot
+        ip_probs = self._gather("ip_list", ip_index)
+        ep_probs = self._gather("ep_list", ep_index)
+        cp_probs = self._gather("cp_list", cp_index)
+        if log:
+            with np.errstate(divide='ignore'):
+                result = np.log(ip_probs) + np.log(ep_probs) + np.log(cp_probs).sum(axis=1)
+        else:
+            result = ip_probs * ep_probs # Same order of multiplications as meter.py
+            for pos in range(0, windows):
+                result *= cp_probs[:, pos]
+        result[~valid] = np.nan
+        return result
+
+    # The list indices (ip_index, ep_index, cp_indices) of an encoded password, shared by the models with the same alphabet and ngram_size
+    def _indices(self, codes):
+        ip_index = self.encoder.index(codes[:self.ngram_size-1])
+        ep_index = self.encoder.index(codes[len(codes)-(self.ngram_size-1):])
+        return ip_index, ep_index, list(self.encoder.ngram_indices(codes, self.ngram_size))
+
+    # The probability of a password from its list indices, see _indices()
+    def _score_indices(self, indices):
+        ip_index, ep_index, cp_indices = indices
+        if self.quantize_bits: # Sum the decoded log-probabilities, no underflow
+            log_prob = self.ip_list.log(ip_index) + self.ep_list.log(ep_index)
+            for index in cp_indices:
+                log_prob += self.cp_list.log(index)
+            return math.exp(log_prob)
+        pw_prob = self.ip_list[ip_index] * self.ep_list[ep_index]
+        for index in cp_indices:
+            pw_prob = pw_prob * self.cp_list[index]
+        return pw_prob
+
 ########################################################################################################################
 
     '''
@@ -260,33 +484,189 @@ class NGramCreator:
                     ValueError: ('%s exceeds max_array_len(%s)', 804357, 131072)
     '''
 
+    # The length a table belongs to, "shared" for the CP table (and counts) of shared_cp
+    def _table_length(self, kind):
+        return "shared" if self.shared_cp and kind.startswith("cp_") else self.length
+
+    # Path of the trained model file, e.g., trained/training_cp_list_4_8.pack, or trained/training_cp_list_4_shared.pack
+    def _model_path(self, kind, extension):
+        return 'trained/'+corpus_name(self.training_file)+'_'+kind+'_'+str(self.ngram_size)+'_'+str(self._table_length(kind))+extension
+
+    # Header of the binary model format, describes what the arrays belong to
+    def _model_header(self, kind):
+        header = {"kind": kind, "alphabet": self.alphabet, "ngram_size": self.ngram_size, "length": self._table_length(kind), "storage": self.storage}
+        if self.quantize_bits:
+            header["quantize_bits"] = self.quantize_bits
+        return header
+
+    # The arrays of a dense table in the binary model format, and the additional header fields
+    def _table_arrays(self, kind, table):
+        if self.quantize_bits:
+            codes, codebook, max_error = quantize(table, self.quantize_bits)
+            logging.info("Length: {} - {} quantized to {} bits ({} codes), max. log-probability error: {:.6f}".format(self.length, kind, self.quantize_bits, len(codebook), max_error))
+            return [("codes", "<u1" if self.quantize_bits == 8 else "<u2", codes), ("codebook", "<f8", codebook)], {"max_error": max_error}
+        dtype = "<f4" if self.backend == "numpy" and self.dtype == "float32" else "<f8"
+        return [("values", dtype, table)], {}
+
+    # The dense table of the arrays of a binary model file
+    def _table_from_arrays(self, header, arrays):
+        if self.quantize_bits:
+            return QuantizedTable(arrays["codes"], arrays["codebook"], header["max_error"])
+        return arrays["values"]
+
     def save(self, kind):
         start = datetime.datetime.now()
         logging.debug("Start: Writing result to disk, this gonna take a while ...")
-        path, file = os.path.split(self.training_file)
-        with open('trained/'+file[:-4]+'_'+kind+'_'+str(self.ngram_size)+'_'+str(self.length)+'.pack', 'wb') as fp:
-            if kind == "ip_list":
-                umsgpack.dump(self.ip_list, fp)
-            elif kind == "cp_list":
-                umsgpack.dump(self.cp_list, fp)
-            elif kind == "ep_list":
-                umsgpack.dump(self.ep_list, fp)
-            else:
-                raise Exception("Unknown list given (required: ip_list, cp_list, or ep_list)")
+        if kind not in ("ip_list", "cp_list", "ep_list"):
+            raise Exception("Unknown list given (required: ip_list, cp_list, or ep_list)")
+        table = getattr(self, kind)
+        if self.model_format == "mmap" and self.storage == "sparse":
+            write_model_file(self._model_path(kind, '.bin'), dict(self._model_header(kind), block=table.block, size=table.size), table.to_arrays())
+        elif self.model_format == "mmap":
+            arrays, fields = self._table_arrays(kind, table)
+            write_model_file(self._model_path(kind, '.bin'), dict(self._model_header(kind), **fields), arrays)
+        else:
+            with open(self._model_path(kind, '.pack'), 'wb') as fp:
+                if self.storage == "sparse":
+                    umsgpack.dump(table.to_dict(), fp)
+                else:
+                    umsgpack.dump(table.tolist() if self.backend == "numpy" else table, fp)
         logging.debug("Done! Everything stored on disk.")
         logging.debug("Storing the data on disk took: {}".format(datetime.datetime.now()-start))
 
-    def load(self, kind):
+    # The raw counts (without the smoothing) of the observed ngrams as sorted (keys, counts), must be called before _prob()
+    def _raw_counts(self, kind):
+        if self._buffered:
+            self._flush_counts(kind)
+        table = getattr(self, kind)
+        initial_count = self._initial_counts.get(kind, 1)
+        if self.storage == "sparse":
+            keys = sorted(index for index, count in table.items() if count)
+            return keys, [table[index] for index in keys]
+        if self.backend == "numpy":
+            raw = table - np.uint32(initial_count)
+            keys = np.flatnonzero(raw)
+            return keys, raw[keys]
+        keys = [index for index, count in enumerate(table) if count > initial_count]
+        return keys, [table[index] - initial_count for index in keys]
+
+    # Stores the raw counts next to the model, e.g., trained/training_cp_counts_4_8.pack, so that new training files can be added later
+    def save_counts(self, kind):
         start = datetime.datetime.now()
-        path, file = os.path.split(self.training_file)
-        with open('trained/'+file[:-4]+'_'+kind+'_'+str(self.ngram_size)+'_'+str(self.length)+'.pack', 'rb') as fp:
-            if kind == "ip_list":
-                self.ip_list = umsgpack.load(fp)
-            elif kind == "cp_list":
-                self.cp_list = umsgpack.load(fp)
-            elif kind == "ep_list":
-                self.ep_list = umsgpack.load(fp)
+        if kind not in ("ip_list", "cp_list", "ep_list"):
+            raise Exception("Unknown list given (required: ip_list, cp_list, or ep_list)")
+        counts_kind = kind.replace("_list", "_counts")
+        keys, counts = self._raw_counts(kind)
+        if self.model_format == "mmap":
+            header = {"kind": counts_kind, "alphabet": self.alphabet, "ngram_size": self.ngram_size, "length": self._table_length(kind)}
+            write_model_file(self._model_path(counts_kind, '.bin'), header, [("keys", "<u8", keys), ("counts", "<u8", counts)])
+        else:
+            with open(self._model_path(counts_kind, '.pack'), 'wb') as fp:
+                umsgpack.dump({"keys": [int(key) for key in keys], "counts": [int(count) for count in counts]}, fp)
+        logging.debug("Storing {} observed {} on disk took: {}".format(len(keys), counts_kind, datetime.datetime.now()-start))
+
+    # Reads the stored raw counts of the observed ngrams as (keys, counts)
+    def _read_counts(self, kind):
+        counts_kind = kind.replace("_list", "_counts")
+        if self.model_format == "mmap":
+            path = self._model_path(counts_kind, '.bin')
+            header, arrays = open_model_file(path, use_numpy=self._buffered or bool(self.smoothing))
+            for key, value in (("kind", counts_kind), ("alphabet", self.alphabet), ("ngram_size", self.ngram_size), ("length", self._table_length(kind))):
+                if header.get(key) != value:
+                    raise Exception("Counts file {} does not match the configuration: {} is {}, expected {}".format(path, key, header.get(key), value))
+            return arrays["keys"], arrays["counts"]
+        with open(self._model_path(counts_kind, '.pack'), 'rb') as fp:
+            data = umsgpack.load(fp)
+        return data["keys"], data["counts"]
+
+    # Adds the stored raw counts to the current counts (initialize the lists first)
+    def load_counts(self, kind):
+        start = datetime.datetime.now()
+        if kind not in ("ip_list", "cp_list", "ep_list"):
+            raise Exception("Unknown list given (required: ip_list, cp_list, or ep_list)")
+        keys, counts = self._read_counts(kind)
+        self._merge_counts(kind, (keys, counts))
+        logging.debug("Loading {} observed {} from disk took: {}".format(len(keys), kind.replace("_list", "_counts"), datetime.datetime.now()-start))
+
+    # Loads the table smoothed with self.smoothing, e.g., trained/training_cp_list_4_8_good_turing_5.bin
+    # It is derived from the raw counts once and cached, until the counts change (train.py update)
+    def _load_smoothed(self, kind, verify=False):
+        path = self._model_path(kind, '_'+self.smoothing_key+'.bin')
+        counts_path = self._model_path(kind.replace("_list", "_counts"), '.bin' if self.model_format == "mmap" else '.pack')
+        if not os.path.exists(counts_path):
+            raise Exception("Smoothing at load time requires the raw counts, please train with save_counts: {}".format(counts_path))
+        if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(counts_path):
+            start = datetime.datetime.now()
+            keys, counts = self._read_counts(kind)
+            dtype = self.dtype if self.backend == "numpy" else "float64"
+            table = smooth(kind, keys, counts, self.alphabet_len, self.ngram_size, self.smoothing, self.smoothing_param, dtype)
+            arrays, fields = self._table_arrays(kind, table)
+            write_model_file(path, dict(self._model_header(kind), smoothing=self.smoothing_key, **fields), arrays)
+            logging.debug("Smoothing {} with {} took: {}".format(kind, self.smoothing_key, datetime.datetime.now()-start))
+        header, arrays = open_model_file(path, use_numpy=self.backend == "numpy" or self.model_format != "mmap", verify=verify)
+        for key, value in dict(self._model_header(kind), smoothing=self.smoothing_key).items():
+            if header.get(key) != value:
+                raise Exception("Model file {} does not match the configuration: {} is {}, expected {}".format(path, key, header.get(key), value))
+        table = self._table_from_arrays(header, arrays)
+        if self.model_format != "mmap": # A copy, as with the pack files
+            table = np.array(table, dtype=self.dtype) if self.backend == "numpy" else table.tolist()
+        setattr(self, kind, table)
+
+    # shared_cp only: the key of the CP table in _SHARED_TABLES and the modification time of the file it is loaded (or smoothed) from
+    def _shared_key(self):
+        extension = '.bin' if self.model_format == "mmap" else '.pack'
+        path = self._model_path("cp_counts" if self.smoothing else "cp_list", extension)
+        modified = os.path.getmtime(path) if os.path.exists(path) else None
+        return (path, self.backend, self.dtype, self.storage, self.smoothing and self.smoothing_key), modified
+
+    def load(self, kind, verify=False):
+        start = datetime.datetime.now()
+        if kind not in ("ip_list", "cp_list", "ep_list"):
+            raise Exception("Unknown list given (required: ip_list, cp_list, or ep_list)")
+        if kind == "cp_list" and self.shared_cp: # Loaded once and used by the models of all lengths, until the file changes
+            shared_key, modified = self._shared_key()
+            cached = _SHARED_TABLES.get(shared_key)
+            if cached is not None and cached[0] == modified:
+                self.cp_list = cached[1]
+                logging.debug("Shared CP table reused")
+                return
+        if self.smoothing:
+            self._load_smoothed(kind, verify)
+        elif self.model_format == "mmap":
+            # Constant-time: the table is mapped read-only, pages are loaded lazily and shared between processes
+            path = self._model_path(kind, '.bin')
+            header, arrays = open_model_file(path, use_numpy=self.backend == "numpy", verify=verify)
+            for key, value in self._model_header(kind).items():
+                if header.get(key) != value:
+                    raise Exception("Model file {} does not match the configuration: {} is {}, expected {}".format(path, key, header.get(key), value))
+            if self.storage == "sparse":
+                setattr(self, kind, SparseTable(arrays["keys"], arrays["values"], arrays["contexts"], arrays["defaults"], header["block"], header["size"]))
             else:
-                raise Exception("Unknown list given (required: ip_list, cp_list, or ep_list)")
+                setattr(self, kind, self._table_from_arrays(header, arrays))
+        else:
+            with open(self._model_path(kind, '.pack'), 'rb') as fp:
+                table = umsgpack.load(fp)
+                if self.storage == "sparse":
+                    setattr(self, kind, SparseTable.from_dict(table))
+                else:
+                    setattr(self, kind, np.asarray(table, dtype=self.dtype) if self.backend == "numpy" else table)
+        if kind == "cp_list" and self.shared_cp:
+            _SHARED_TABLES[shared_key] = (modified, self.cp_list)
         logging.debug("Done! Everything loaded from disk.")
         logging.debug("Loading the data from disk took: {}".format(datetime.datetime.now()-start))
+
+    # Approximate number of bytes held by the loaded tables (mmap: the mapped size, the pages are loaded lazily)
+    # The shared CP table (shared_cp) is not counted, it stays loaded for all lengths
+    def memory_usage(self):
+        total = 0
+        for kind in (("ip_list", "ep_list") if self.shared_cp else ("ip_list", "cp_list", "ep_list")):
+            table = getattr(self, kind)
+            if isinstance(table, SparseTable):
+                total += len(table.keys) * 16 + len(table.contexts) * 16 # index and probability per entry
+            elif isinstance(table, QuantizedTable):
+                total += table.nbytes()
+            elif isinstance(table, list):
+                total += len(table) * 32 # pointer and float object per entry
+            else: # numpy array, array.array, or memoryview
+                total += len(table) * table.itemsize
+        return total
@@ -0,0 +1,108 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+''' Quantized tables: 8- or 16-bit codes into a codebook of log-probabilities
+
+Similar to the quantization of KenLM: the log-probabilities of a table are split
+into 2^bits bins of the same width between the lowest and the highest value, every
+bin is represented by the mean log-probability of its entries. If a table has at most
+2^bits distinct probabilities, the codebook is exact. max_error is the largest
+absolute error |ln(p) - codebook[code]| of the table, thus, the log-probability
+of a password with one IP, w CPs, and one EP is off by at most
+max_error(IP) + w * max_error(CP) + max_error(EP).
+'''
+
+# External modules
+import math # decoding without numpy
+try:
+    import numpy as np # quantizing # pip install numpy
+except ImportError:
+    np = None
+
+BITS = (8, 16)
+
+''' Quantizes the probabilities of a table, returns (codes, codebook, max_error) '''
+def quantize(probs, bits):
+    if np is None:
+        raise Exception("Quantizing requires numpy # pip install numpy")
+    if bits not in BITS:
+        raise Exception("Unsupported number of bits (required: 8 or 16): {}".format(bits))
+    probs = np.asarray(probs, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        logs = np.log(probs) # Probability 0 is -inf, it gets its own code
+    values, inverse, counts = np.unique(logs, return_inverse=True, return_counts=True)
+    size = 1 << bits
+    if len(values) <= size: # Exact
+        codebook = values
+        codes = inverse
+    else:
+        finite = np.isfinite(values)
+        reserved = 0 if finite.all() else 1 # -inf is values[0]
+        bins = size - reserved
+        # Bins of the same width in log space, the error of a bin is at most its width, empty bins are dropped
+        finite_values = values[reserved:]
+        low, high = finite_values[0], finite_values[-1]
+        bin_of_value = np.minimum(((finite_values - low) / (high - low) * bins).astype(np.int64), bins-1)
+        bin_of_value = np.unique(bin_of_value, return_inverse=True)[1].reshape(-1) + reserved
+        codebook = np.empty(bin_of_value[-1]+1, dtype=np.float64)
+        codebook[:reserved] = -np.inf
+        weights = counts[reserved:].astype(np.float64)
+        sums = np.bincount(bin_of_value, weights=values[reserved:] * weights, minlength=len(codebook))
+        totals = np.bincount(bin_of_value, weights=weights, minlength=len(codebook))
+        codebook[reserved:] = sums[reserved:] / totals[reserved:] # Mean log-probability of the entries of a bin
+        codes = np.concatenate([np.zeros(reserved, dtype=np.int64), bin_of_value])[inverse]
+    decoded = codebook[codes]
+    with np.errstate(invalid='ignore'):
+        errors = np.where(np.isneginf(logs), 0.0, np.abs(logs - decoded))
+    max_error = float(errors.max()) if len(errors) else 0.0
+    return codes.astype(np.uint8 if bits == 8 else np.uint16), codebook, max_error
+
+'''
+A read-only table of codes into a codebook of log-probabilities, used like a list of
+probabilities (table[index]). codes and codebook are numpy arrays, memoryviews of a
+mapped model file, or lists.
+'''
+class QuantizedTable:
+
+    def __init__(self, codes, codebook, max_error=0.0):
+        self.codes = codes
+        self.codebook = codebook
+        self.max_error = max_error
+        self.probabilities = [math.exp(log) for log in codebook] # 2^bits entries at most
+        self._arrays = None # numpy only: the arrays used by take() and take_log()
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return self.probabilities[self.codes[index]]
+
+    ''' The decoded log-probability of a list index '''
+    def log(self, index):
+        return self.codebook[self.codes[index]]
+
+    # numpy only: codes and codebook as numpy arrays (views of the mapped file, no copy)
+    def _numpy(self):
+        if self._arrays is None:
+            self._arrays = (np.asarray(self.codes), np.asarray(self.codebook, dtype=np.float64), np.asarray(self.probabilities, dtype=np.float64))
+        return self._arrays
+
+    ''' The probabilities of an array of list indices (numpy) '''
+    def take(self, indices):
+        codes, codebook, probabilities = self._numpy()
+        return probabilities[codes[indices]]
+
+    ''' The log-probabilities of an array of list indices (numpy) '''
+    def take_log(self, indices):
+        codes, codebook, probabilities = self._numpy()
+        return codebook[codes[indices]]
+
+    def max(self):
+        return max(self.probabilities)
+
+    def min(self):
+        return min(prob for prob in self.probabilities if prob > 0.0)
+
+    # Bytes of the codes and the codebook
+    def nbytes(self):
+        return len(self.codes) * (self.codes.itemsize if hasattr(self.codes, "itemsize") else 2) + len(self.codebook) * 8
@@ -0,0 +1,62 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+''' Loads the Markov models of the configured lengths on demand '''
+
+# External modules
+from collections import OrderedDict # least recently used order
+import threading # the registry is shared by the threads of a process
+import logging # logging debug infos
+
+'''
+Maps a password length to its Markov model. A model is loaded by load_model(length)
+when the first password of that length arrives. If the loaded models exceed
+memory_budget bytes (0: unlimited), the least recently used models are evicted,
+the model that was just requested is always kept.
+'''
+class ModelRegistry:
+
+    def __init__(self, load_model, lengths, memory_budget=0):
+        self.load_model = load_model
+        self.lengths = frozenset(lengths)
+        self.memory_budget = memory_budget
+        self.models = OrderedDict() # length -> model, least recently used first
+        self.sizes = {} # length -> bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # The model of this length, None if there is no Markov model for this length
+    def get(self, length):
+        if length not in self.lengths:
+            return None
+        with self.lock:
+            model = self.models.get(length)
+            if model is not None:
+                self.hits += 1
+                self.models[length] = self.models.pop(length) # Most recently used
+                return model
+            self.misses += 1
+            logging.debug("Length: {} - Loading the model ...".format(length))
+            model = self.load_model(length)
+            self.models[length] = model
+            self.sizes[length] = model.memory_usage()
+            self._evict()
+            return model
+
+    # Drops the least recently used models until the budget is met again
+    def _evict(self):
+        if not self.memory_budget:
+            return
+        while len(self.models) > 1 and sum(self.sizes.values()) > self.memory_budget:
+            length, model = self.models.popitem(last=False)
+            del self.sizes[length]
+            self.evictions += 1
+            logging.debug("Length: {} - Model evicted ({} bytes loaded)".format(length, sum(self.sizes.values())))
+
+    def memory_usage(self):
+        return sum(self.sizes.values())
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "loaded": sorted(self.models), "bytes": self.memory_usage()}
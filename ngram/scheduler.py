@@ -0,0 +1,117 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+''' Estimates the peak memory of the training jobs and runs them within a memory budget
+
+The estimates are conservative and derived from the table sizes (alphabet_length ^ (n-1)
+for IP and EP, alphabet_length ^ n for CP) and the bytes per entry of the backend
+during counting, prob(), and save(). Sparse tables only hold the observed ngrams,
+their number is bounded by the size of the training file.
+'''
+
+# External modules
+import time # polling the running jobs
+import platform # PyPy stores lists of floats unboxed
+import logging # logging debug infos
+
+PROCESS_BASE = 64 << 20 # Interpreter, modules, and buffers of every process
+PENDING_BUFFER = 48 << 20 # numpy only: up to 1,048,576 buffered indices (a list of ints) per table
+LIST_ENTRY = 8 if platform.python_implementation() == "PyPy" else 32 # pointer and float object
+SPARSE_ENTRY = 120 # dict entry and int objects of an observed ngram while counting
+
+''' The budget in bytes of size_mb, None (no limit) for 0, a budget must leave room for the jobs besides PROCESS_BASE '''
+def memory_budget(size_mb=0):
+    if size_mb <= 0:
+        return None
+    if size_mb << 20 <= PROCESS_BASE:
+        raise Exception("The memory budget of {} MB is too small, a process alone needs {}, please increase training_memory_mb or use 0 (no limit)".format(size_mb, megabytes(PROCESS_BASE)))
+    return size_mb << 20
+
+'''
+Peak bytes of the tables of one length (without PROCESS_BASE):
+    tables:        kinds that are trained, e.g., ("ip_list", "ep_list") without the shared CP table
+    counts_only:   only the counts, including their export, e.g., a shard of the parallel counting
+    corpus_bytes:  size of the training file, bounds the number of observed ngrams
+The tables stay in memory until the process ends, on top of them, the largest table needs
+temporary memory while it is normalized, its raw counts are stored, or it is quantized and saved.
+'''
+def estimate_model_memory(alphabet_len, ngram_size, backend="list", dtype="float64", storage="dense", model_format="pack",
+                          quantize_bits=0, save_counts=False, tables=("ip_list", "cp_list", "ep_list"), counts_only=False, corpus_bytes=None):
+    sizes = [alphabet_len ** (ngram_size if kind == "cp_list" else ngram_size-1) for kind in tables]
+    largest = max(sizes) if sizes else 0
+    observed = min(largest, corpus_bytes) if corpus_bytes is not None else largest # Observed ngrams of the largest table
+    if storage == "sparse":
+        total = sum(min(size, corpus_bytes) if corpus_bytes is not None else size for size in sizes) * SPARSE_ENTRY
+        if counts_only:
+            return total + observed * SPARSE_ENTRY # The exported dict
+        return total + observed * (16 + (44 if save_counts else 0)) # The arrays of SparseTable.from_counts(), and the sorted keys
+    if backend == "numpy":
+        itemsize = 4 if dtype == "float32" else 8
+        if counts_only:
+            return sum(sizes) * 4 + largest * 4 + len(sizes) * PENDING_BUFFER # uint32 counts, and the pickled export
+        steady = sum(sizes) * itemsize + largest * 4 + len(sizes) * PENDING_BUFFER # Probabilities, and the counts of the table in prob()
+        transient = [largest * (LIST_ENTRY + 9) if model_format == "pack" else largest * itemsize] # tolist() and the encoding, or a copy of the bytes
+        if save_counts:
+            transient.append(largest * 16)
+        if quantize_bits:
+            transient.append(largest * 48) # log(), np.unique(), and the decoded table in float64
+        return steady + max(transient)
+    if counts_only:
+        return sum(sizes) * 8 + observed * SPARSE_ENTRY # Pointers to small ints, and the exported dict
+    transient = [largest * (9 if model_format == "pack" else 16)]
+    if save_counts:
+        transient.append(observed * 44) # Lists of the observed keys and counts
+    if quantize_bits:
+        transient.append(largest * 56)
+    return sum(sizes) * LIST_ENTRY + max(transient)
+
+'''
+The estimated peak bytes of one process, models: the tables of every length it trains,
+e.g., [("ip_list", "cp_list", "ep_list")], options: see estimate_model_memory()
+'''
+def estimate_process_memory(models, alphabet_len, ngram_size, **options):
+    return PROCESS_BASE + sum(estimate_model_memory(alphabet_len, ngram_size, tables=tables, **options) for tables in models)
+
+def megabytes(size):
+    return "{:.0f} MB".format(size / float(1 << 20))
+
+''' Raises an exception with a report if a single job does not fit into the budget, jobs: [(name, bytes), ...] '''
+def check_budget(jobs, budget):
+    if budget is None:
+        return
+    too_large = [(name, size) for name, size in jobs if size > budget]
+    if too_large:
+        report = ", ".join("{}: {}".format(name, megabytes(size)) for name, size in too_large)
+        raise Exception("Not enough memory, the budget is {} but the estimated peak memory exceeds it for {}. "
+                        "Please use a smaller ngram_size or alphabet, backend numpy with dtype float32, storage sparse, or increase training_memory_mb".format(megabytes(budget), report))
+
+'''
+Runs function(job) for all jobs in a pool of processes, at most processes jobs at once and only as
+many jobs as fit into the budget together (the largest jobs first), returns the results in job order.
+jobs: [(job, estimated bytes), ...], every job must fit into the budget (see check_budget())
+'''
+def run_within_budget(pool, function, jobs, budget, processes):
+    pending = sorted(range(len(jobs)), key=lambda position: -jobs[position][1])
+    running = [] # (position, AsyncResult)
+    results = [None] * len(jobs)
+    in_use = 0
+    while pending or running:
+        for position in list(pending):
+            if len(running) >= processes:
+                break
+            size = jobs[position][1]
+            if budget is None or in_use + size <= budget or not running: # A single job always runs
+                running.append((position, pool.apply_async(function, (jobs[position][0],))))
+                pending.remove(position)
+                in_use += size
+        logging.debug("Running {} jobs with an estimated {} ({} jobs waiting)".format(len(running), megabytes(in_use), len(pending)))
+        while True: # Wait until a job is done
+            done = [(position, result) for position, result in running if result.ready()]
+            if done:
+                break
+            time.sleep(0.05)
+        for position, result in done:
+            results[position] = result.get() # Raises the exception of a failed job
+            running.remove((position, result))
+            in_use -= jobs[position][1]
+    return results
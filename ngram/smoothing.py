@@ -0,0 +1,113 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+''' Derives the probability tables from the stored raw counts with a chosen smoothing method
+
+Training stores the raw counts (save_counts), so another smoothing only needs the
+counts, not another pass over the training file. All methods are normalized per
+block (CP: one block of alphabet_length entries per ngram-1 context, IP/EP: a
+single block) and give every ngram a probability > 0:
+
+    add_k        (count + k) / (block count + k * block), k = 1 is the add-one smoothing of train.py
+    good_turing  Good-Turing adjusted counts r* = (r+1) N(r+1) / N(r) for r < param (Katz threshold),
+                 every unseen ngram gets N(1) / N(0), then normalized per block
+    backoff      Interpolated absolute discounting with discount D = param: CP interpolates with the
+                 (n-1)-gram CP of the shorter context, down to add-one smoothed unigrams,
+                 IP/EP interpolate with the uniform distribution
+'''
+
+# External modules
+try:
+    import numpy as np # pip install numpy
+except ImportError:
+    np = None
+
+DEFAULT_PARAMS = {"add_k": 1.0, "good_turing": 5, "backoff": 0.75}
+
+''' The parameter of a method, None is its default '''
+def smoothing_param(method, param=None):
+    if method not in DEFAULT_PARAMS:
+        raise Exception("Unknown smoothing given (required: {}): {}".format(", ".join(sorted(DEFAULT_PARAMS)), method))
+    return DEFAULT_PARAMS[method] if param is None else param
+
+''' Names the smoothed tables, e.g., "good_turing_5", used for the cache files '''
+def smoothing_key(method, param=None):
+    return "{}_{}".format(method, smoothing_param(method, param))
+
+# Dense float64 counts of a table from the observed (keys, counts)
+def _dense(keys, counts, size):
+    table = np.zeros(size, dtype=np.float64)
+    table[np.asarray(keys, dtype=np.int64)] = np.asarray(counts, dtype=np.float64)
+    return table
+
+# Divides every block by its sum, blocks without any mass become uniform
+def _normalize(rows):
+    totals = rows.sum(axis=1, keepdims=True)
+    uniform = np.full(rows.shape, 1.0 / rows.shape[1])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(totals > 0.0, rows / totals, uniform)
+
+def _add_k(rows, k):
+    return (rows + k) / (rows.sum(axis=1, keepdims=True) + k * rows.shape[1])
+
+def _good_turing(rows, threshold):
+    counts = rows.astype(np.int64)
+    observed = counts[counts > 0]
+    count_of_counts = np.bincount(np.minimum(observed, threshold+1), minlength=threshold+2) # N(r), r > threshold are not needed
+    adjusted = np.arange(threshold+1, dtype=np.float64) # r* = r, unless it is adjusted below
+    for r in range(1, threshold):
+        if count_of_counts[r] > 0 and count_of_counts[r+1] > 0: # Otherwise, N(r+1) is no estimate
+            adjusted[r] = (r+1) * count_of_counts[r+1] / float(count_of_counts[r])
+    unseen = counts.size - len(observed)
+    unseen_count = count_of_counts[1] / float(unseen) if unseen and count_of_counts[1] else 0.5 # N(1) / N(0), or half an observation
+    smoothed = np.where(counts >= threshold, counts, adjusted[np.minimum(counts, threshold)]) # Large counts are reliable
+    smoothed = np.where(counts == 0, unseen_count, smoothed)
+    return _normalize(smoothed)
+
+# Interpolated absolute discounting of one block per row with the lower order distribution (broadcastable to rows)
+def _discount(rows, lower, discount):
+    totals = rows.sum(axis=-1, keepdims=True)
+    types = (rows > 0).sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        higher = np.maximum(rows - discount, 0.0) / totals
+        weight = discount * types / totals # The discounted mass
+    return np.where(totals > 0.0, higher + weight * lower, lower)
+
+def _backoff_cp(rows, alphabet_len, discount):
+    if rows.shape[0] == 1: # Unigrams: add-one smoothing
+        return _add_k(rows, 1.0)
+    # The (m-1)-gram counts: the context without its first char, summed up
+    shorter = rows.reshape(alphabet_len, -1, alphabet_len).sum(axis=0)
+    lower = _backoff_cp(shorter, alphabet_len, discount)
+    # Context index = first char * A^(m-2) + shorter context, thus, the lower order repeats for every first char
+    probs = _discount(rows.reshape(alphabet_len, -1, alphabet_len), lower[np.newaxis, :, :], discount)
+    return probs.reshape(rows.shape)
+
+'''
+Returns the probability table (a dense numpy array of dtype) of the raw counts (keys, counts) of kind.
+keys are the list indices of the observed ngrams, as stored by NGramCreator.save_counts()
+'''
+def smooth(kind, keys, counts, alphabet_len, ngram_size, method, param=None, dtype="float64"):
+    if np is None:
+        raise Exception("Smoothing at load time requires numpy # pip install numpy")
+    param = smoothing_param(method, param)
+    if kind == "cp_list":
+        rows = _dense(keys, counts, alphabet_len ** ngram_size).reshape(-1, alphabet_len)
+    elif kind in ("ip_list", "ep_list"):
+        rows = _dense(keys, counts, alphabet_len ** (ngram_size-1)).reshape(1, -1)
+    else:
+        raise Exception("Unknown list given (required: ip_list, cp_list, or ep_list)")
+    if method == "add_k":
+        if param <= 0:
+            raise Exception("add_k requires k > 0, otherwise unseen ngrams have probability 0: {}".format(param))
+        probs = _add_k(rows, float(param))
+    elif method == "good_turing":
+        probs = _good_turing(rows, int(param))
+    else:
+        if not 0.0 < param < 1.0:
+            raise Exception("backoff requires a discount 0 < D < 1: {}".format(param))
+        if kind == "cp_list":
+            probs = _backoff_cp(rows, alphabet_len, float(param))
+        else:
+            probs = _discount(rows, np.full(rows.shape, 1.0 / rows.shape[1]), float(param))
+    return probs.reshape(-1).astype(dtype)
@@ -0,0 +1,107 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+''' Sparse n-gram tables that only store the n-grams observed in the training corpus '''
+
+# External modules
+import array # compact storage without numpy
+from bisect import bisect_left # lookups in the sorted arrays
+try:
+    import numpy as np # optional vectorized lookups # pip install numpy
+except ImportError:
+    np = None
+
+'''
+A table of size contexts * block, normalized per block (CP: one block per ngram-1
+context with alphabet_length entries, IP/EP: a single block). Only observed
+ngrams are stored, the probabilities are exactly the add-one smoothed ones of the
+dense lists:
+
+    observed:                  (count + 1) / (sum of counts in block + block)
+    unseen, observed context:       1      / (sum of counts in block + block)
+    unseen context:                 1      /                           block
+
+keys:     sorted list indices of the observed ngrams
+values:   their probabilities
+contexts: sorted block numbers (index // block) with at least one observed ngram
+defaults: the probability of an unseen ngram in this block
+'''
+class SparseTable:
+
+    def __init__(self, keys, values, contexts, defaults, block, size):
+        self.keys = keys
+        self.values = values
+        self.contexts = contexts
+        self.defaults = defaults
+        self.block = block
+        self.size = size
+        self.fallback = 1.0 / block
+        self._arrays = None # numpy only: the arrays used by take()
+
+    ''' Normalizes a dict of raw counts index -> count, i.e., applies add-one smoothing '''
+    @classmethod
+    def from_counts(cls, counts, block, size):
+        keys = array.array('Q', sorted(counts))
+        totals = {} # block number -> sum of counts
+        for index, count in counts.items():
+            context = index // block
+            totals[context] = totals.get(context, 0) + count
+        contexts = array.array('Q', sorted(totals))
+        defaults = array.array('d', (1.0 / (totals[context] + block) for context in contexts))
+        values = array.array('d', ((counts[index] + 1.0) / (totals[index // block] + block) for index in keys))
+        return cls(keys, values, contexts, defaults, block, size)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        pos = bisect_left(self.keys, index)
+        if pos < len(self.keys) and self.keys[pos] == index:
+            return self.values[pos]
+        return self._default(index // self.block)
+
+    # Probability of an unseen ngram in the given block
+    def _default(self, context):
+        pos = bisect_left(self.contexts, context)
+        if pos < len(self.contexts) and self.contexts[pos] == context:
+            return self.defaults[pos]
+        return self.fallback
+
+    # Sum of all probabilities of one block (observed and unseen ngrams), should be 1.0
+    def block_sum(self, context=0):
+        start = bisect_left(self.keys, context * self.block)
+        end = bisect_left(self.keys, (context+1) * self.block)
+        observed = 0.0
+        for pos in range(start, end):
+            observed += self.values[pos]
+        return observed + (self.block - (end - start)) * self._default(context)
+
+    # numpy only: vectorized __getitem__() for an array of list indices
+    def take(self, indices):
+        if self._arrays is None:
+            self._arrays = tuple(np.asarray(data) for data in (self.keys, self.values, self.contexts, self.defaults))
+        keys, values, contexts, defaults = self._arrays
+        indices = np.asarray(indices, dtype=np.uint64)
+        result = np.full(indices.shape, self.fallback, dtype=np.float64)
+        if len(contexts):
+            context = indices // np.uint64(self.block)
+            pos = np.minimum(np.searchsorted(contexts, context), len(contexts)-1)
+            hit = contexts[pos] == context
+            result[hit] = defaults[pos[hit]]
+        if len(keys):
+            pos = np.minimum(np.searchsorted(keys, indices), len(keys)-1)
+            hit = keys[pos] == indices
+            result[hit] = values[pos[hit]]
+        return result
+
+    # Named arrays for the binary model format
+    def to_arrays(self):
+        return [("keys", "<u8", self.keys), ("values", "<f8", self.values), ("contexts", "<u8", self.contexts), ("defaults", "<f8", self.defaults)]
+
+    # Plain Python data for umsgpack
+    def to_dict(self):
+        return {"keys": list(self.keys), "values": list(self.values), "contexts": list(self.contexts), "defaults": list(self.defaults), "block": self.block, "size": self.size}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(array.array('Q', data["keys"]), array.array('d', data["values"]), array.array('Q', data["contexts"]), array.array('d', data["defaults"]), data["block"], data["size"])
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+''' This script loads the training once and serves strength estimates to other local processes
+
+Protocol: one JSON object per line, over a Unix socket or localhost TCP (server_address).
+    request:  {"passwords": ["password1", "iloveyou", ...], "log": false}
+    response: {"scores": [1.2e-08, 3.4e-07, ...]}
+A score is null if there is no Markov model for the password's length or if the
+password contains invalid characters (including lone surrogates). A request line
+may be up to LINE_LIMIT bytes long, a longer one is skipped up to its newline and answered with one {"error": ...}. Requests from all connections that arrive
+while a batch is being scored are coalesced into the next vectorized batch.
+Send SIGHUP to reload the configuration and the models without dropping requests.
+Requires Python 3 (asyncio) and numpy.
+'''
+
+# Load external modules
+from configs.configure import *
+import os # remove stale sockets
+import signal # SIGHUP -> reload
+import asyncio # event loop
+
+LINE_LIMIT = 64 << 20 # Longest request line in bytes, a batch of many passwords does not fit into the default 64 KiB
+
+''' Loads the training data of all configured lengths from disk, returns a dict length -> model '''
+def load_models(config):
+    models = {}
+    for length in config.LENGTHS:
+        ngram_creator = NGramCreator(config.ngram_options(length))
+        for kind in ("ip_list", "cp_list", "ep_list"):
+            ngram_creator.load(kind)
+        models[length] = ngram_creator
+    logging.debug("Models loaded for the lengths: {}".format(sorted(models)))
+    return models
+
+# Whether a password is a valid Unicode string, a lone surrogate (e.g., "\ud800") is valid JSON, but can not be encoded
+def _is_encodable(password):
+    try:
+        password.encode("utf-8")
+        return True
+    except UnicodeEncodeError:
+        return False
+
+''' Scores a list of passwords with the models of their lengths, None if there is no model or the password is invalid '''
+def score_passwords(passwords, models, log=False):
+    scores = [None] * len(passwords)
+    positions_by_length = {}
+    for position, password in enumerate(passwords):
+        if _is_encodable(password): # Otherwise invalid, it would fail the whole batch
+            positions_by_length.setdefault(len(password), []).append(position)
+    for length, positions in positions_by_length.items():
+        ngram_creator = models.get(length)
+        if ngram_creator is None: # No Markov model for this length
+            continue
+        batch = ngram_creator.score_batch([passwords[position] for position in positions], log=log)
+        for position, score in zip(positions, batch.tolist()):
+            if score == score: # NaN: invalid characters
+                scores[position] = score
+    return scores
+
+class ScoringServer:
+
+    def __init__(self, config, max_batch):
+        self.config = config
+        self.models = load_models(config)
+        self.max_batch = max_batch
+        self.queue = None # (passwords, log, future) of the pending requests
+        self.reloading = False
+
+    # Takes everything that is pending, scores it in as few vectorized batches as possible, and answers the requests
+    async def _batcher(self):
+        while True:
+            requests = [await self.queue.get()]
+            size = len(requests[0][0])
+            while size < self.max_batch and not self.queue.empty(): # Coalesce concurrent requests
+                request = self.queue.get_nowait()
+                requests.append(request)
+                size += len(request[0])
+            models = self.models # A reload swaps the reference, this batch keeps using the old models
+            for log in (False, True):
+                selected = [request for request in requests if request[1] == log]
+                if not selected:
+                    continue
+                passwords = [password for request in selected for password in request[0]]
+                try:
+                    scores = score_passwords(passwords, models, log)
+                except Exception:
+                    self._score_separately(selected, models, log) # The error stays with the request that caused it
+                    continue
+                offset = 0
+                for request in selected:
+                    if not request[2].done():
+                        request[2].set_result(scores[offset:offset+len(request[0])])
+                    offset += len(request[0])
+
+    # Fallback of a failed batch: scores every request on its own
+    def _score_separately(self, requests, models, log):
+        for passwords, _, future in requests:
+            if future.done():
+                continue
+            try:
+                future.set_result(score_passwords(passwords, models, log))
+            except Exception as e:
+                future.set_exception(e)
+
+    # Reads one request line, a line longer than LINE_LIMIT is dropped up to and including its newline and returned as None
+    async def _read_line(self, reader):
+        overrun = False
+        while True:
+            try:
+                line = await reader.readuntil(b"\n")
+                return None if overrun else line
+            except asyncio.IncompleteReadError as e: # End of the stream, the last line may lack its newline
+                return None if overrun else e.partial
+            except asyncio.LimitOverrunError as e: # Nothing was consumed, skip the buffered part and keep on looking for the newline
+                overrun = True
+                await reader.readexactly(e.consumed)
+
+    async def _handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await self._read_line(reader)
+                if line is None: # Exactly one response per request line, also for a line that is too long
+                    writer.write((json.dumps({"error": "Request too long (limit: {} bytes)".format(LINE_LIMIT)})+"\n").encode("utf-8"))
+                    await writer.drain()
+                    continue
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode("utf-8"))
+                    passwords = request["passwords"]
+                    if not isinstance(passwords, list) or not all(isinstance(password, str) for password in passwords):
+                        raise ValueError("passwords must be a list of strings")
+                    future = loop.create_future()
+                    await self.queue.put((passwords, bool(request.get("log", False)), future))
+                    response = {"scores": await future}
+                except Exception as e:
+                    response = {"error": str(e)}
+                writer.write((json.dumps(response)+"\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # Loads the new model set next to the old one, then swaps them, requests are served by the old models meanwhile
+    async def reload(self):
+        if self.reloading:
+            return
+        self.reloading = True
+        try:
+            loop = asyncio.get_running_loop()
+            config = await loop.run_in_executor(None, Configure, {"name":"My Config"})
+            self.models = await loop.run_in_executor(None, load_models, config)
+            self.config = config
+            logging.info("Models reloaded ...")
+        except (Exception, SystemExit) as e: # Configure() exits on a malformed config
+            sys.stderr.write("\x1b[1;%dm" % (31) + "Reload failed, keeping the old models: {}\n".format(e) + "\x1b[0m")
+        finally:
+            self.reloading = False
+
+    async def serve(self, address):
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        batcher = loop.create_task(self._batcher())
+        loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(self.reload()))
+        if address.startswith("/"): # Unix socket
+            if os.path.exists(address):
+                os.remove(address)
+            server = await asyncio.start_unix_server(self._handle, path=address, limit=LINE_LIMIT)
+        else: # host:port
+            host, port = address.rsplit(":", 1)
+            server = await asyncio.start_server(self._handle, host=host, port=int(port), limit=LINE_LIMIT)
+        loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel) # Shutdown
+        logging.info("Listening on {} ...".format(address))
+        try:
+            async with server:
+                await server.serve_forever()
+        except asyncio.CancelledError:
+            logging.info("Shutting down ...")
+        finally:
+            batcher.cancel()
+
+def main():
+    try:
+        global CONFIG
+        CONFIG = Configure({"name":"My Config"})
+        server = ScoringServer(CONFIG, CONFIG.BATCH_SIZE if CONFIG.BATCH_SIZE > 0 else 65536)
+        asyncio.run(server.serve(CONFIG.SERVER_ADDRESS))
+    except KeyboardInterrupt:
+        print('User canceled')
+        sys.exit(1)
+    except Exception as e:
+        sys.stderr.write("\x1b[1;%dm" % (31) + "Error: {}\n".format(e) + "\x1b[0m")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    print("{0}: {1:%Y-%m-%d %H:%M:%S}\n".format("Start", datetime.datetime.now()))
+    print("Press Ctrl+C to shutdown")
+    main()
+    print("{0}: {1:%Y-%m-%d %H:%M:%S}".format("Done", datetime.datetime.now()))
@@ -10,86 +10,270 @@
 # Load external modules
 from configs.configure import *
 
+''' Creates the ngram-object for one length '''
+def _new_ngram_creator(length, progress_bar):
+    return NGramCreator(CONFIG.ngram_options(length, progress_bar=progress_bar, name="NGramCreator, Session: {}, Length: {}, Progress bar: {}".format(CONFIG.NAME, length, progress_bar)))
+
+''' The tables the i-th model trains, with shared_cp the first model owns the CP table of all lengths '''
+def _kinds(index):
+    if CONFIG.SHARED_CP and index > 0:
+        return ("ip_list", "ep_list")
+    return ("ip_list", "cp_list", "ep_list")
+
+''' The estimated peak bytes of a process that trains the tables of models (the kinds of every length) '''
+def _process_memory(models, counts_only=False):
+    return estimate_process_memory(models, len(CONFIG.ALPHABET), CONFIG.NGRAM_SIZE, backend=CONFIG.BACKEND, dtype=CONFIG.DTYPE,
+                                   storage=CONFIG.STORAGE, model_format=CONFIG.MODEL_FORMAT, quantize_bits=CONFIG.QUANTIZE_BITS,
+                                   save_counts=CONFIG.SAVE_COUNTS, counts_only=counts_only, corpus_bytes=os.path.getsize("input/"+CONFIG.TRAINING_FILE))
+
 ''' Generates a new ngram-object via init, count, prob, (save) '''
 def worker(data):
     "This data was received by the process:"
     length = data[0]
     progress_bar = data[1]
 
-    ngram_creator = NGramCreator({
-        "name": ("NGramCreator, Session: {}, Length: {}, Progress bar: {}".format(CONFIG.NAME, length, progress_bar)),
-        "alphabet": CONFIG.ALPHABET,
-        "ngram_size": CONFIG.NGRAM_SIZE,
-        "training_file": "input/"+CONFIG.TRAINING_FILE,
-        "length": length,
-        "progress_bar": progress_bar
-    })
+    ngram_creator = _new_ngram_creator(length, progress_bar)
+    metrics = Metrics("Length: {}".format(length)) # Returned to the parent process
 
     # Initial probability (IP)
     logging.debug("ip_list init() ...")
-    ngram_creator._init_lists("ip_list")
+    with metrics.timer("init"):
+        ngram_creator._init_lists("ip_list")
 
     logging.debug("ip_list count() ...")
-    ngram_creator._count("ip_list")
+    with metrics.timer("count"):
+        ngram_creator._count("ip_list")
+
+    if CONFIG.SAVE_COUNTS:
+        logging.debug("ip_list save_counts() ...")
+        with metrics.timer("save_counts"):
+            ngram_creator.save_counts("ip_list")
 
     logging.debug("ip_list prob() ...")
-    ngram_creator._prob("ip_list")
+    with metrics.timer("prob"):
+        ngram_creator._prob("ip_list")
 
     logging.debug("ip_list save() ...")
-    ngram_creator.save("ip_list")
+    with metrics.timer("save"):
+        ngram_creator.save("ip_list")
 
     logging.debug("Training IP done ...")
 
     # Conditional probability (CP)
     logging.debug("cp_list init() ...")
-    ngram_creator._init_lists("cp_list")
+    with metrics.timer("init"):
+        ngram_creator._init_lists("cp_list")
 
     logging.debug("cp_list count() ...")
-    ngram_creator._count("cp_list")
+    with metrics.timer("count"):
+        ngram_creator._count("cp_list")
+
+    if CONFIG.SAVE_COUNTS:
+        logging.debug("cp_list save_counts() ...")
+        with metrics.timer("save_counts"):
+            ngram_creator.save_counts("cp_list")
 
     logging.debug("cp_list prob() ...")
-    ngram_creator._prob("cp_list")
+    with metrics.timer("prob"):
+        ngram_creator._prob("cp_list")
 
     logging.debug("cp_list save() ...")
-    ngram_creator.save("cp_list")
+    with metrics.timer("save"):
+        ngram_creator.save("cp_list")
 
     logging.debug("Training CP done ...")
 
     # End probability (EP)
     logging.debug("ep_list init() ...")
-    ngram_creator._init_lists("ep_list")
+    with metrics.timer("init"):
+        ngram_creator._init_lists("ep_list")
 
     logging.debug("ep_list count() ...")
-    ngram_creator._count("ep_list")
+    with metrics.timer("count"):
+        ngram_creator._count("ep_list")
+
+    if CONFIG.SAVE_COUNTS:
+        logging.debug("ep_list save_counts() ...")
+        with metrics.timer("save_counts"):
+            ngram_creator.save_counts("ep_list")
 
     logging.debug("ep_list prob() ...")
-    ngram_creator._prob("ep_list")
+    with metrics.timer("prob"):
+        ngram_creator._prob("ep_list")
 
     logging.debug("ep_list save() ...")
-    ngram_creator.save("ep_list")
+    with metrics.timer("save"):
+        ngram_creator.save("ep_list")
 
     logging.debug("Training EP done ...")
+    metrics.merge({"counters": ngram_creator.counters})
+    return {"counters": metrics.counters, "timers": metrics.timers}
+
+''' Stores the raw counts (optional), then prob() and save() for all counted ngram-objects '''
+def _finish(ngram_creators):
+    for index, ngram_creator in enumerate(ngram_creators):
+        for kind in _kinds(index):
+            if CONFIG.SAVE_COUNTS:
+                logging.debug("Length: {} - {} save_counts() ...".format(ngram_creator.length, kind))
+                with METRICS.timer("save_counts"):
+                    ngram_creator.save_counts(kind)
+            logging.debug("Length: {} - {} prob() ...".format(ngram_creator.length, kind))
+            with METRICS.timer("prob"):
+                ngram_creator._prob(kind)
+            logging.debug("Length: {} - {} save() ...".format(ngram_creator.length, kind))
+            with METRICS.timer("save"):
+                ngram_creator.save(kind)
+        METRICS.merge({"counters": ngram_creator.counters})
+        logging.debug("Training length {} done ...".format(ngram_creator.length))
+
+''' Generates the ngram-objects of all lengths and trains them with a single pass over the training file '''
+def train_single_pass():
+    ngram_creators = []
+    for index, length in enumerate(CONFIG.LENGTHS):
+        ngram_creator = _new_ngram_creator(length, False) # The single pass has its own progress bar
+        for kind in _kinds(index):
+            logging.debug("Length: {} - {} init() ...".format(length, kind))
+            ngram_creator._init_lists(kind)
+        ngram_creators.append(ngram_creator)
+
+    logging.debug("ip_list, cp_list, ep_list count() ...")
+    with METRICS.timer("count"):
+        METRICS.merge({"counters": count_corpus(ngram_creators, "input/"+CONFIG.TRAINING_FILE, CONFIG.PROGRESS_BAR, shared_cp=CONFIG.SHARED_CP, input_format=CONFIG.INPUT_FORMAT, aggregate=CONFIG.AGGREGATE_INPUT)})
+
+    _finish(ngram_creators)
+
+''' Counts the ngrams of all lengths within one byte range of the training file, returns the partial counts '''
+def count_shard(shard):
+    "This byte range was received by the process:"
+    start, end = shard
+    ngram_creators = []
+    for index, length in enumerate(CONFIG.LENGTHS):
+        ngram_creator = _new_ngram_creator(length, False)
+        for kind in _kinds(index):
+            ngram_creator._init_lists(kind, initial_count=0) # The smoothing is added once, when merging
+        ngram_creators.append(ngram_creator)
+    metrics = Metrics("Shard: {}-{}".format(start, end)) # Returned to the parent process
+    with metrics.timer("count"):
+        metrics.merge({"counters": count_corpus(ngram_creators, "input/"+CONFIG.TRAINING_FILE, False, start, end, CONFIG.SHARED_CP, CONFIG.INPUT_FORMAT, CONFIG.AGGREGATE_INPUT)})
+    partial_counts = {}
+    for index, ngram_creator in enumerate(ngram_creators):
+        partial_counts[ngram_creator.length] = dict((kind, ngram_creator._export_counts(kind)) for kind in _kinds(index))
+        metrics.merge({"counters": ngram_creator.counters})
+    logging.debug("Shard bytes {}-{} counted ...".format(start, end))
+    return partial_counts, {"counters": metrics.counters, "timers": metrics.timers}
+
+''' Map-reduce: counts byte ranges of the training file in parallel, sums the partial counts, then prob() and save() '''
+def train_parallel_counting(processes):
+    shards = split_corpus("input/"+CONFIG.TRAINING_FILE, CONFIG.NO_CPUS)
+    logging.debug("Counting {} shards with {} processes ...".format(len(shards), processes))
+
+    ngram_creators = []
+    for index, length in enumerate(CONFIG.LENGTHS):
+        ngram_creator = _new_ngram_creator(length, False)
+        for kind in _kinds(index):
+            ngram_creator._init_lists(kind)
+        ngram_creators.append(ngram_creator)
+
+    with MultiProcessingLog() as log:
+        pool = log.pool(processes)
+        for partial_counts, shard_metrics in pool.imap_unordered(count_shard, shards): # Merge as soon as a shard is done
+            METRICS.merge(shard_metrics)
+            with METRICS.timer("merge"):
+                for index, ngram_creator in enumerate(ngram_creators):
+                    for kind in _kinds(index):
+                        ngram_creator._merge_counts(kind, partial_counts[ngram_creator.length][kind])
+        pool.close() # no more tasks can be submitted to the pool
+        pool.join() # wait for the worker processes to exit
+
+    _finish(ngram_creators)
+
+''' Incremental training: adds the counts of a new training file to the stored counts of every length and renormalizes '''
+def update(new_training_file):
+    logging.debug("Update with '{}' started ...".format(new_training_file))
+    ngram_creators = []
+    for index, length in enumerate(CONFIG.LENGTHS):
+        ngram_creator = _new_ngram_creator(length, False) # The model name is still derived from training_file
+        for kind in _kinds(index):
+            ngram_creator._init_lists(kind)
+            logging.debug("Length: {} - {} load_counts() ...".format(length, kind))
+            with METRICS.timer("load_counts"):
+                ngram_creator.load_counts(kind)
+        ngram_creators.append(ngram_creator)
+
+    logging.debug("ip_list, cp_list, ep_list count() ...")
+    with METRICS.timer("count"):
+        METRICS.merge({"counters": count_corpus(ngram_creators, new_training_file, CONFIG.PROGRESS_BAR, shared_cp=CONFIG.SHARED_CP, input_format=CONFIG.INPUT_FORMAT, aggregate=CONFIG.AGGREGATE_INPUT)}) # Only the delta is read
+
+    _finish(ngram_creators)
+
+''' Samples GUESS_SAMPLES passwords from the trained model of every length and stores the Monte Carlo guess table '''
+def build_guess_table():
+    samples = []
+    for length in CONFIG.LENGTHS:
+        ngram_creator = _new_ngram_creator(length, False)
+        with METRICS.timer("load"):
+            for kind in ("ip_list", "cp_list", "ep_list"):
+                ngram_creator.load(kind)
+        logging.debug("Length: {} - Sampling {} passwords ...".format(length, CONFIG.GUESS_SAMPLES))
+        with METRICS.timer("guess_table"):
+            samples.append(sample_model(ngram_creator, CONFIG.GUESS_SAMPLES, seed=length)) # Reproducible
+    header = {"alphabet": CONFIG.ALPHABET, "ngram_size": CONFIG.NGRAM_SIZE, "lengths": CONFIG.LENGTHS, "samples": CONFIG.GUESS_SAMPLES}
+    if CONFIG.SMOOTHING:
+        header["smoothing"] = smoothing_key(CONFIG.SMOOTHING, CONFIG.SMOOTHING_PARAM)
+    GuessTable.build(samples, header).save(guess_table_path(CONFIG.TRAINING_FILE, CONFIG.NGRAM_SIZE))
+
+''' Derives the tables smoothed with smoothing / smoothing_param from the stored raw counts, no pass over the training file '''
+def build_smoothed():
+    if not CONFIG.SMOOTHING:
+        raise Exception("No smoothing configured, please set smoothing (add_k, good_turing, or backoff)")
+    for length in CONFIG.LENGTHS:
+        ngram_creator = _new_ngram_creator(length, False)
+        with METRICS.timer("smooth"):
+            for kind in ("ip_list", "cp_list", "ep_list"):
+                ngram_creator.load(kind) # Creates the cached table, if it is missing or outdated
+        logging.debug("Length: {} - Smoothed with {} ...".format(length, ngram_creator.smoothing_key))
 
 ''' Manages the training '''
 def train():
     try:
         logging.debug("Training started ...")
 
-        ''' Singleprocessing
-        for length in CONFIG.LENGTHS:
-            data = [length, CONFIG.PROGRESS_BAR]
-            worker(data)
-        '''
-
-        #''' Multiprocessing
-        data = []
-        for length in CONFIG.LENGTHS:
-            data.append([length, CONFIG.PROGRESS_BAR])
-        pool = multiprocessing.Pool(processes=CONFIG.NO_CPUS)
-        pool.map(worker, data)
-        pool.close() # no more tasks can be submitted to the pool
-        pool.join() # wait for the worker processes to exit
-        #'''
+        budget = memory_budget(CONFIG.TRAINING_MEMORY_MB)
+        models = [_kinds(index) for index in range(len(CONFIG.LENGTHS))]
+        if CONFIG.PARALLEL_COUNTING:
+            # The parent holds the tables of all lengths, every shard process their counts
+            parent, shard = _process_memory(models), _process_memory(models, counts_only=True)
+            check_budget([("the parent process and one shard", parent + shard)], budget)
+            processes = CONFIG.NO_CPUS if budget is None else max(1, min(CONFIG.NO_CPUS, (budget - parent) // shard))
+            logging.info("Estimated peak memory: parent {}, shard {}, budget {} - counting with {} processes".format(megabytes(parent), megabytes(shard), megabytes(budget) if budget else "no limit", processes))
+            train_parallel_counting(processes)
+        elif CONFIG.SINGLE_PASS or CONFIG.SHARED_CP: # The shared CP table needs the lines of all lengths
+            check_budget([("all lengths (single pass)", _process_memory(models))], budget)
+            train_single_pass()
+        else:
+            ''' Singleprocessing
+            for length in CONFIG.LENGTHS:
+                data = [length, CONFIG.PROGRESS_BAR]
+                worker(data)
+            '''
+
+            #''' Multiprocessing
+            # Every job gets its estimated peak memory, the jobs that run at once fit into the budget (besides this process)
+            jobs = []
+            for index, length in enumerate(CONFIG.LENGTHS):
+                jobs.append(([length, CONFIG.PROGRESS_BAR], _process_memory(models[index:index+1])))
+            check_budget([("length {} (with this process)".format(data[0]), size + PROCESS_BASE) for data, size in jobs], budget)
+            logging.info("Estimated peak memory: {}, budget {}".format(", ".join("length {}: {}".format(data[0], megabytes(size)) for data, size in jobs), megabytes(budget) if budget else "no limit"))
+            with MultiProcessingLog() as log:
+                pool = log.pool(CONFIG.NO_CPUS)
+                for worker_metrics in run_within_budget(pool, worker, jobs, budget - PROCESS_BASE if budget is not None else None, CONFIG.NO_CPUS):
+                    METRICS.merge(worker_metrics)
+                pool.close() # no more tasks can be submitted to the pool
+                pool.join() # wait for the worker processes to exit
+            #'''
+
+        if CONFIG.GUESS_SAMPLES > 0:
+            build_guess_table()
 
     except Exception as e:
         sys.stderr.write("\x1b[1;%dm" % (31) + "Training failed: {}\n".format(e) + "\x1b[0m")
@@ -97,9 +281,30 @@ def train():
 
 def main():
     try:
-        global CONFIG
+        global CONFIG, METRICS
         CONFIG = Configure({"name":"My Config"})
-        train()
+        METRICS = Metrics("train")
+        metrics_file = os.path.join(CONFIG.METRICS_DIR, "train_metrics.json") if CONFIG.METRICS_DIR else None
+        if metrics_file and CONFIG.METRICS_INTERVAL > 0:
+            METRICS.start(metrics_file, CONFIG.METRICS_INTERVAL)
+        if len(sys.argv) == 3 and sys.argv[1] == "update": # pypy train.py update input/new.txt
+            if not CONFIG.SAVE_COUNTS:
+                raise Exception("Updating requires the raw counts, please enable save_counts")
+            update(sys.argv[2])
+            if CONFIG.GUESS_SAMPLES > 0:
+                build_guess_table()
+        elif len(sys.argv) == 2 and sys.argv[1] == "guess_table": # pypy train.py guess_table
+            build_guess_table()
+        elif len(sys.argv) == 2 and sys.argv[1] == "smooth": # pypy train.py smooth
+            build_smoothed()
+            if CONFIG.GUESS_SAMPLES > 0:
+                build_guess_table()
+        else:
+            train()
+        METRICS.stop()
+        if metrics_file:
+            METRICS.write(metrics_file)
+            logging.debug("Metrics written to {}".format(metrics_file))
     except KeyboardInterrupt:
         print('User canceled')
         sys.exit(1)
@@ -0,0 +1,208 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+'''
+:description: Measures count(), prob(), save(), load(), and meter.eval() (including the lazy loading) on synthetic corpora
+:usage: pypy utils/benchmark.py --ngram-sizes 3,4 --alphabet-sizes 26,62 --corpus-sizes 100000,1000000
+        python3 utils/benchmark.py --backend numpy --compare results/benchmark_pypy.json
+
+Every case (ngram size x alphabet size x corpus size) runs in its own process within
+a temporary directory, so the peak RSS belongs to this case only. The corpora are
+generated with a fixed seed, thus, the results of different interpreters, machines,
+and commits are comparable. The results are written as JSON (--output), --compare
+reports the change against an earlier result file and fails on a regression.
+'''
+
+import os
+import sys
+import json
+import time
+import bisect
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import datetime
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# Chars ordered by their frequency in real password leaks, the first K chars are the alphabet of size K
+CHARS = "aeio1nrlst20mcuydh93bkgp84576vjfwzxAEqORLNISMTBYCP!.UGHDJ F-K*#V_\\XZW';Q],@&?~+$={^/%"
+PHASES = ("count", "prob", "save", "load", "eval")
+
+''' Writes a synthetic password corpus: syllables drawn from a Zipf distribution over chars with a Zipf frequency '''
+def generate_corpus(path, lines, alphabet, lengths, seed):
+    rng = random.Random(seed)
+    char_weights = _zipf(len(alphabet))
+    syllables = ["".join(alphabet[_draw(rng, char_weights)] for _ in range(rng.randint(2, 4))) for _ in range(1000)]
+    syllable_weights = _zipf(len(syllables))
+    all_lengths = list(range(min(lengths)-2, max(lengths)+3)) # Also lengths without a model, as in a real corpus
+    with open(path, 'w') as fp:
+        for _ in range(lines):
+            length = rng.choice(all_lengths)
+            password = ""
+            while len(password) < length:
+                password += syllables[_draw(rng, syllable_weights)]
+            fp.write(password[:length] + "\n")
+
+# Cumulative Zipf weights of size ranks
+def _zipf(size):
+    cumulative = []
+    total = 0.0
+    for rank in range(size):
+        total += 1.0 / (rank+1)
+        cumulative.append(total)
+    return cumulative
+
+# A random rank, drawn according to the cumulative weights
+def _draw(rng, cumulative):
+    return min(bisect.bisect_left(cumulative, rng.random() * cumulative[-1]), len(cumulative)-1)
+
+# Peak resident set size of this process in MB
+def _peak_rss():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0 # macOS: bytes, Linux: KB
+
+''' Runs a single case in the current directory (input/training.txt, input/eval.txt, configs/dev.json), prints the result '''
+def run_case(case):
+    sys.path.insert(0, ROOT)
+    import logging
+    import meter # also loads configs.configure and ngram.ngram_creator
+    logging.getLogger().setLevel(logging.WARNING) # No debug output within the measurements
+    config = meter.Configure({"name": "Benchmark"})
+    meter.CONFIG = config
+    timings = dict((phase, 0.0) for phase in PHASES)
+    for length in config.LENGTHS:
+        ngram_creator = meter.NGramCreator(config.ngram_options(length, name="Benchmark"))
+        for kind in ("ip_list", "cp_list", "ep_list"):
+            start = time.time()
+            ngram_creator._init_lists(kind)
+            ngram_creator._count(kind)
+            timings["count"] += time.time() - start
+            start = time.time()
+            ngram_creator._prob(kind)
+            timings["prob"] += time.time() - start
+            start = time.time()
+            ngram_creator.save(kind)
+            timings["save"] += time.time() - start
+            start = time.time()
+            ngram_creator.load(kind)
+            timings["load"] += time.time() - start
+        del ngram_creator
+    start = time.time()
+    meter.eval()
+    timings["eval"] = time.time() - start
+    result = dict(case)
+    result.update({
+        "seconds": timings,
+        "training_pw_per_second": case["corpus_size"] / max(timings["count"], 1e-9),
+        "eval_pw_per_second": case["eval_size"] / max(timings["eval"], 1e-9),
+        "peak_rss_mb": _peak_rss(),
+        "model_mb": sum(os.path.getsize(os.path.join("trained", name)) for name in os.listdir("trained")) / 1e6
+    })
+    sys.stdout.write(json.dumps(result) + "\n")
+
+# The key of a case, to find the same case in another result file
+def _case_key(result):
+    return (result["ngram_size"], result["alphabet_size"], result["corpus_size"], result["backend"], result["storage"], result["model_format"], result["dtype"], result["batch_size"])
+
+''' Prints the change of every phase against an earlier run, returns False if a phase got slower than tolerance '''
+def compare(results, baseline, tolerance, min_seconds):
+    previous = dict((_case_key(result), result) for result in baseline["cases"])
+    passed = True
+    for result in results:
+        old = previous.get(_case_key(result))
+        if old is None:
+            continue
+        changes = []
+        for phase in PHASES:
+            ratio = result["seconds"][phase] / max(old["seconds"][phase], 1e-9)
+            marker = ""
+            if ratio > tolerance and result["seconds"][phase] >= min_seconds: # Ignore the noise of very short phases
+                marker = " <- regression"
+                passed = False
+            changes.append("{} {:.2f}x{}".format(phase, ratio, marker))
+        changes.append("peak RSS {:.2f}x".format(result["peak_rss_mb"] / max(old["peak_rss_mb"], 1e-9)))
+        print("n={} A={} lines={}: {}".format(result["ngram_size"], result["alphabet_size"], result["corpus_size"], ", ".join(changes)))
+    return passed
+
+def _int_list(value):
+    return [int(item) for item in value.split(",")]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks training and scoring on synthetic corpora")
+    parser.add_argument("--ngram-sizes", type=_int_list, default=[2, 3])
+    parser.add_argument("--alphabet-sizes", type=_int_list, default=[26, 62])
+    parser.add_argument("--corpus-sizes", type=_int_list, default=[10000, 100000])
+    parser.add_argument("--lengths", type=_int_list, default=[6, 8])
+    parser.add_argument("--eval-size", type=int, default=10000, help="number of passwords scored by meter.eval()")
+    parser.add_argument("--backend", default="list")
+    parser.add_argument("--dtype", default="float64")
+    parser.add_argument("--storage", default="dense")
+    parser.add_argument("--model-format", default="pack")
+    parser.add_argument("--batch-size", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="result file (default: results/benchmark_<interpreter>_<date>.json)")
+    parser.add_argument("--compare", metavar="RESULT_FILE", help="earlier result file, exits with 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=1.2, help="slowdown that counts as a regression (default: 1.2)")
+    parser.add_argument("--min-seconds", type=float, default=0.5, help="shorter phases are not checked for regressions (default: 0.5)")
+    parser.add_argument("--case", help=argparse.SUPPRESS) # Internal: run one case in this process
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(json.loads(args.case))
+        return
+
+    interpreter = "{} {}".format(platform.python_implementation(), platform.python_version())
+    workdir = tempfile.mkdtemp(prefix="nemo-benchmark-")
+    results = []
+    try:
+        for alphabet_size in args.alphabet_sizes:
+            alphabet = CHARS[:alphabet_size]
+            for corpus_size in args.corpus_sizes:
+                corpus = os.path.join(workdir, "training_{}_{}.txt".format(alphabet_size, corpus_size))
+                generate_corpus(corpus, corpus_size, alphabet, args.lengths, args.seed)
+                evaluation = os.path.join(workdir, "eval_{}.txt".format(alphabet_size))
+                if not os.path.exists(evaluation): # Only passwords with a model, the eval throughput is not diluted by Info lines
+                    generate_corpus(evaluation + ".all", args.eval_size * 4, alphabet, args.lengths, args.seed+1)
+                    with open(evaluation + ".all") as source, open(evaluation, 'w') as target:
+                        target.writelines([line for line in source if len(line)-1 in args.lengths][:args.eval_size])
+                for ngram_size in args.ngram_sizes:
+                    case = {"ngram_size": ngram_size, "alphabet_size": alphabet_size, "corpus_size": corpus_size, "eval_size": sum(1 for line in open(evaluation)),
+                            "lengths": args.lengths, "backend": args.backend, "dtype": args.dtype, "storage": args.storage, "model_format": args.model_format, "batch_size": args.batch_size}
+                    casedir = os.path.join(workdir, "case")
+                    shutil.rmtree(casedir, ignore_errors=True)
+                    for folder in ("input", "trained", "results", "configs"):
+                        os.makedirs(os.path.join(casedir, folder))
+                    shutil.copy(corpus, os.path.join(casedir, "input", "training.txt"))
+                    shutil.copy(evaluation, os.path.join(casedir, "input", "eval.txt"))
+                    with open(os.path.join(casedir, "configs", "dev.json"), 'w') as configfile:
+                        json.dump({"name": "Benchmark", "eval_file": "eval.txt", "training_file": "training.txt", "alphabet": alphabet, "lengths": args.lengths,
+                                   "ngram_size": ngram_size, "no_cpus": 1, "progress_bar": False, "backend": args.backend, "dtype": args.dtype,
+                                   "storage": args.storage, "model_format": args.model_format, "batch_size": args.batch_size}, configfile)
+                    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)], cwd=casedir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                    stdout, stderr = process.communicate()
+                    if process.returncode != 0:
+                        raise Exception("Case {} failed:\n{}".format(case, stderr.decode("utf-8", "replace")))
+                    result = json.loads(stdout.decode("utf-8").strip().splitlines()[-1])
+                    results.append(result)
+                    print("n={} A={} lines={}: count {:.2f}s prob {:.2f}s save {:.2f}s load {:.2f}s eval {:.2f}s ({:.0f} pw/s), peak RSS {:.1f} MB".format(
+                        ngram_size, alphabet_size, corpus_size, result["seconds"]["count"], result["seconds"]["prob"], result["seconds"]["save"],
+                        result["seconds"]["load"], result["seconds"]["eval"], result["eval_pw_per_second"], result["peak_rss_mb"]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(ROOT, "results", "benchmark_{}_{:%Y%m%d_%H%M%S}.json".format(platform.python_implementation().lower(), datetime.datetime.now()))
+    with open(output, 'w') as fp:
+        json.dump({"interpreter": interpreter, "machine": platform.machine(), "platform": platform.platform(), "date": datetime.datetime.now().isoformat(), "cases": results}, fp, indent=4)
+    print("Results written to {}".format(output))
+
+    if args.compare:
+        with open(args.compare) as fp:
+            if not compare(results, json.load(fp), args.tolerance, args.min_seconds):
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
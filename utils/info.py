@@ -6,57 +6,192 @@
 :contact: maximilian.golla@rub.de
 :version: 0.7.1, 2019-07-11
 :description: Reports some statistics about password length, alphabet, ASCII encoding etc.
+              and proposes an alphabet and lengths, including the size of the resulting model
 :usage: pypy utils/info.py input/eval.txt
+        pypy utils/info.py input/training.txt --ngram-size 4 --coverage 0.99 --write configs/training.json
+
+The file is memory-mapped and profiled in newline-aligned byte ranges by a pool of
+processes: 1st pass char and byte histograms, 2nd pass for every line the rarest
+char (its rank in the frequency-ordered alphabet) and the length. Thus, the number
+of lines that an alphabet of the K most frequent chars keeps is known for every K.
 '''
 
+import io
+import os
 import sys
-import operator
+import json
+import mmap
+import argparse
+import multiprocessing
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ngram.corpus import split_corpus
+
+BLOCK_SIZE = 64 << 20 # Bytes decoded at once per process
+ALPHABET_SIZES = (10, 26, 36, 62, 72, 85, 95) # Digits, lower, lower+digits, alphanumeric, ..., printable ASCII
+LINE_BREAKS = frozenset(u'\r\n')
+
+# Code point -> char of the rank, chars without a rank (e.g., an embedded '\r' or invalid UTF-8) get the rank unknown
+class Ranks(dict):
+
+    def __init__(self, ranks, unknown):
+        dict.__init__(self, ranks)
+        self.unknown = unknown
 
-def is_ascii(s):
-    return all((ord(c) >= 32 and ord(c) <= 126) for c in s)
+    def __missing__(self, code):
+        return self.unknown
+
+# The newline-aligned blocks of a byte range
+def _blocks(path, start, end):
+    with open(path, 'rb') as fp:
+        if end <= start:
+            return
+        mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            position = start
+            while position < end:
+                stop = min(position + BLOCK_SIZE, end)
+                if stop < end:
+                    newline = mm.rfind(b'\n', position, stop)
+                    if newline >= position: # Otherwise, a line longer than the block
+                        stop = newline + 1
+                yield mm[position:stop]
+                position = stop
+        finally:
+            mm.close()
+
+# 1st pass: byte and char histogram of a byte range
+def count_chars(job):
+    path, start, end = job
+    byte_counts = Counter()
+    char_counts = Counter()
+    for block in _blocks(path, start, end):
+        byte_counts.update(bytearray(block))
+        char_counts.update(block.decode('utf-8', 'replace'))
+    return byte_counts, char_counts
+
+# 2nd pass: number of lines per (length, rank of the rarest char) of a byte range, rank -1 is the empty line
+def count_lines(job):
+    path, start, end, ranks = job
+    counts = Counter()
+    for block in _blocks(path, start, end):
+        text = block.decode('utf-8', 'replace')
+        lines = text.split(u'\n')
+        if lines and lines[-1] == u'':
+            lines.pop()
+        # Map every char to the char with the code point of its rank, max() then finds the rarest char in C
+        counts.update((len(line), ord(max(line.translate(ranks))) if line else -1) for line in (line.rstrip(u'\r') for line in lines))
+    return counts
 
 def main():
-    min_len = sys.maxsize
-    max_len = -sys.maxsize - 1
-    alphabet = dict()
-    lengths = set()
-    everything_ascii = "Yes"
-
-    with open(sys.argv[1], 'r') as passwordfile:
-        for line in passwordfile:
-            line = line.rstrip('\r\n')
-            length = len(line)
-            for char in line:
-                if char in alphabet:
-                    alphabet[char] += 1
-                else:
-                    alphabet[char] = 1
-            if length < min_len:
-                min_len = length
-            if length > max_len:
-                max_len = length
-            lengths.add(length)
-            if is_ascii(line) == False:
-                everything_ascii = "No"
-
-    # Alphabet
-    alphabet = sorted(alphabet.items(), key=operator.itemgetter(1), reverse=True)
-    lengths = sorted(lengths)
+    parser = argparse.ArgumentParser(description="Profiles a password file and proposes a configuration")
+    parser.add_argument("password_file")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(), help="number of processes (default: all cores)")
+    parser.add_argument("--ngram-size", type=int, default=4, help="n-gram size used for the size estimates (default: 4)")
+    parser.add_argument("--coverage", type=float, default=0.99, help="share of the lines the proposed alphabet keeps (default: 0.99)")
+    parser.add_argument("--min-share", type=float, default=0.001, help="minimum share of the lines of a proposed length (default: 0.001)")
+    parser.add_argument("--write", metavar="CONFIG", help="writes the proposed configuration, e.g., configs/training.json")
+    args = parser.parse_args()
+
+    path = args.password_file
+    jobs = split_corpus(path, max(args.processes, 1) * 4) # More ranges than processes, for an even load
+    pool = multiprocessing.Pool(processes=args.processes)
+
+    byte_counts = Counter()
+    char_counts = Counter()
+    for partial_bytes, partial_chars in pool.imap_unordered(count_chars, [(path, start, end) for start, end in jobs]):
+        byte_counts.update(partial_bytes)
+        char_counts.update(partial_chars)
+    for char in LINE_BREAKS:
+        char_counts.pop(char, None)
+    invalid = char_counts.pop(u'\ufffd', 0) # Invalid UTF-8, never part of the alphabet
+
+    # Alphabet ordered by frequency, ties by code point for a stable order
+    alphabet = sorted(char_counts, key=lambda char: (-char_counts[char], char))
+    ranks = dict((ord(char), rank) for rank, char in enumerate(alphabet))
+    to_char = chr if sys.version_info[0] >= 3 else unichr
+    ranks = Ranks(((code, to_char(rank)) for code, rank in ranks.items()), to_char(len(alphabet))) # Unknown chars are rarer than any char
+
+    lines = Counter() # (length, rarest rank) -> number of lines
+    for partial in pool.imap_unordered(count_lines, [(path, start, end, ranks) for start, end in jobs]):
+        lines.update(partial)
+    pool.close() # no more tasks can be submitted to the pool
+    pool.join() # wait for the worker processes to exit
+
+    total_lines = sum(lines.values())
+    lengths = Counter()
+    for (length, rank), count in lines.items():
+        lengths[length] += count
+    non_empty = sorted(length for length in lengths if length > 0)
+
+    # Lines kept by the K most frequent chars: all lines whose rarest char has a rank < K
+    def kept(size, selected_lengths=None):
+        return sum(count for (length, rank), count in lines.items() if 0 <= rank < size and (selected_lengths is None or length in selected_lengths))
+
+    non_empty_lines = total_lines - lengths.get(0, 0)
+    alphabet_size = len(alphabet)
+    for size in range(1, len(alphabet)+1):
+        if non_empty_lines and kept(size) >= args.coverage * non_empty_lines:
+            alphabet_size = size
+            break
+    proposed_alphabet = alphabet[:alphabet_size]
+    kept_by_length = Counter()
+    for (length, rank), count in lines.items():
+        if 0 <= rank < alphabet_size:
+            kept_by_length[length] += count
+    proposed_lengths = sorted(length for length in kept_by_length if length >= args.ngram_size and kept_by_length[length] >= args.min_share * non_empty_lines)
+
     alpha = []
-    for e in alphabet:
-        if e[0] == '"':
+    for char in alphabet:
+        if char == '"':
             alpha.append('\\"') # escape quotes
-        elif e[0] == '\\':
+        elif char == '\\':
             alpha.append('\\\\') # escape backslash
         else:
-            alpha.append(e[0])
-    print("File: {}".format(sys.argv[1].split('/')[-1]))
-    print("Min length: {}".format(min_len))
-    print("Max length: {}".format(max_len))
-    print("Observed password lengths: [{}]".format(','.join([str(x) for x in list(lengths)])))
+            alpha.append(char)
+    print("File: {}".format(path.split('/')[-1]))
+    print("Lines: {} ({} bytes, {} empty)".format(total_lines, os.path.getsize(path), lengths.get(0, 0)))
+    print("Min length: {}".format(non_empty[0] if non_empty else 0))
+    print("Max length: {}".format(non_empty[-1] if non_empty else 0))
+    print("Observed password lengths: [{}]".format(','.join([str(x) for x in non_empty])))
     print('Alphabet (escaped for Python, but watch out for the space char): "{}"'.format(''.join(alpha)))
     print("Alphabet length: {}".format(len(alphabet)))
-    print("ASCII only: {}".format(everything_ascii))
+    print("ASCII only: {}".format("Yes" if all(32 <= byte <= 126 or byte in (10, 13) for byte in byte_counts) else "No"))
+    print("Invalid UTF-8 sequences: {}".format(invalid))
+
+    print("\nLines per length:")
+    for length in non_empty:
+        print("{:>6}: {:>12} ({:6.2%})".format(length, lengths[length], float(lengths[length]) / non_empty_lines))
+
+    print("\nLines kept by the K most frequent chars:")
+    for size in sorted(set([size for size in ALPHABET_SIZES if size < len(alphabet)] + [alphabet_size, len(alphabet)])):
+        print("{:>6}: {:>12} ({:6.2%})".format(size, kept(size), float(kept(size)) / max(non_empty_lines, 1)))
+
+    # Dense tables: IP and EP have K^(n-1), CP has K^n entries, for every length
+    n = args.ngram_size
+    entries = 2 * alphabet_size ** (n-1) + alphabet_size ** n
+    kept_lines = kept(alphabet_size, set(proposed_lengths))
+    print("\nProposal (coverage {:.2%}): alphabet of {} chars, lengths [{}]".format(args.coverage, alphabet_size, ','.join(str(length) for length in proposed_lengths)))
+    print("Lines kept: {} ({:.2%})".format(kept_lines, float(kept_lines) / max(non_empty_lines, 1)))
+    print("Model size with {}-grams: {} entries per length, {} lengths".format(n, entries, len(proposed_lengths)))
+    print("    numpy / mmap (float64): {:.1f} MB, (float32): {:.1f} MB".format(entries * 8 * len(proposed_lengths) / 1e6, entries * 4 * len(proposed_lengths) / 1e6))
+    print("    Python lists:           {:.1f} MB (to train or load a length: {:.1f} MB)".format(entries * 32 * len(proposed_lengths) / 1e6, entries * 32 / 1e6))
+
+    if args.write:
+        config = {
+            "name": os.path.splitext(os.path.basename(args.write))[0],
+            "eval_file": "eval.txt",
+            "training_file": os.path.basename(path),
+            "alphabet": u"".join(proposed_alphabet),
+            "lengths": proposed_lengths,
+            "ngram_size": n,
+            "no_cpus": args.processes,
+            "progress_bar": False
+        }
+        with io.open(args.write, 'w', encoding='utf-8') as configfile:
+            configfile.write(json.dumps(config, indent=4, ensure_ascii=False))
+        print("\nConfiguration written to {}".format(args.write))
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
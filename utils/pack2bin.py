@@ -0,0 +1,46 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+'''
+:description: Converts trained umsgpack models ('*.pack') to the memory-mappable binary format ('*.bin'), no retraining required
+:usage: python3 utils/pack2bin.py configs/dev.json trained/training_*.pack
+'''
+
+import os
+import re
+import sys
+import json
+import umsgpack # pip install u-msgpack-python
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ngram.model_file import write_model_file, open_model_file
+
+# e.g., training_cp_list_4_8.pack
+PACK_NAME = re.compile(r'^(.+)_(ip_list|cp_list|ep_list)_(\d+)_(\d+)\.pack$')
+
+def convert(pack_path, alphabet):
+    match = PACK_NAME.match(os.path.basename(pack_path))
+    if match is None:
+        raise Exception("Unexpected file name (required: <name>_<kind>_<ngram-size>_<length>.pack): {}".format(pack_path))
+    kind, ngram_size, length = match.group(2), int(match.group(3)), int(match.group(4))
+    with open(pack_path, 'rb') as fp:
+        table = umsgpack.load(fp)
+    expected = len(alphabet) ** (ngram_size if kind == "cp_list" else ngram_size-1)
+    if len(table) != expected:
+        raise Exception("{} has {} entries, but the alphabet implies {}, wrong config?".format(pack_path, len(table), expected))
+    bin_path = pack_path[:-len('.pack')]+'.bin'
+    write_model_file(bin_path, {"kind": kind, "alphabet": alphabet, "ngram_size": ngram_size, "length": length, "storage": "dense"}, [("values", "<f8", table)])
+    open_model_file(bin_path, verify=True) # Read back and compare the checksums
+    return bin_path
+
+def main():
+    if len(sys.argv) < 3:
+        sys.stderr.write("Usage: {} <config.json> <model.pack> [<model.pack> ...]\n".format(sys.argv[0]))
+        sys.exit(1)
+    with open(sys.argv[1], 'r') as configfile:
+        alphabet = json.load(configfile).get("alphabet", "abcdefghijklmnopqrstuvwxyz")
+    for pack_path in sys.argv[2:]:
+        print("{} -> {}".format(pack_path, convert(pack_path, alphabet)))
+
+if __name__ == '__main__':
+    main()
@@ -7,30 +7,140 @@
 :version: 0.7.1, 2019-07-11
 :description: Sorts passwords in the strength meter outfile 'eval_result.txt' by likelihood
 :usage: pypy utils/sortresult.py results/eval_result.txt > results/eval_result_sorted.txt
+        pypy utils/sortresult.py --top 1000 results/eval_result.txt
+        pypy utils/sortresult.py --bottom 1000 - < results/eval_result.txt
+
+Files of any size are sorted with bounded memory: chunks of --chunk-size lines are
+sorted in memory and spilled to temporary files (runs), the runs are merged with a
+k-way merge. Whenever fan_in runs are open, they are merged into one while reading,
+thus, at most fan_in temporary files are open (--fan-in, default: derived from the
+limit of open files). --top / --bottom only keep a heap of
+k lines. The "Info: ..." lines (no Markov model for this length, invalid characters)
+are not sorted, they are written after the sorted lines, or skipped and counted with
+--top / --bottom.
 '''
 
+import io
 import sys
+import heapq
+import argparse
+import tempfile
+import itertools
+try:
+    import resource # limit of open files
+except ImportError: # Windows
+    resource = None
+
+IO_BUFFER = 1 << 20 # Read and write in blocks of 1 MiB
+FAN_IN = 128 # Maximum number of open runs (temporary files), if the limit of open files is unknown or higher
+RESERVED_FILES = 16 # stdin, stdout, stderr, the input and Info files, and the interpreter
+
+''' The maximum number of open runs: FAN_IN, or less if the limit of open files (ulimit -n) is lower '''
+def default_fan_in():
+    if resource is None:
+        return FAN_IN
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return FAN_IN
+    return max(2, min(FAN_IN, soft - RESERVED_FILES))
 
-# Read file
-with open(sys.argv[1], 'r') as inputfile:
-    out = []
+def open_text(path, mode):
+    if path == "-":
+        return io.open((sys.stdin if mode == 'r' else sys.stdout).fileno(), mode, buffering=IO_BUFFER, encoding='utf-8', errors='replace', closefd=False)
+    return io.open(path, mode, buffering=IO_BUFFER, encoding='utf-8', errors='replace')
+
+# Splits the input into (prob, rest) records, the Info lines go to the info bucket (a file, or a counter with info=None)
+def read_records(inputfile, info, skipped):
     for line in inputfile:
         line = line.rstrip('\r\n')
-        splitted = line.split('\t')
-        if splitted[0].startswith("Info: No Markov model for this length:"):
-            out.append((-1.0,splitted[1]))
-            # Instead of adding them, you could also discard them
-            # pass
-        else:
-            prob = float(splitted[0])
-            pw = splitted[1]
-            out.append((prob,pw))
-
-# Sort by prob
-out = sorted(out, key=lambda tup: tup[0], reverse=True)
-
-# Output
-for entry in out:
-    prob = entry[0]
-    pw = entry[1]
-    print("{}\t{}".format(prob,pw))
\ No newline at end of file
+        splitted = line.split('\t', 1)
+        if splitted[0].startswith("Info:"):
+            if info is not None:
+                info.write(line + "\n")
+            skipped[0] += 1
+            continue
+        yield float(splitted[0]), splitted[1] if len(splitted) > 1 else "" # The guess number (optional) and the password
+
+def format_record(record):
+    return "{}\t{}\n".format(record[0], record[1])
+
+# The records of a run, as merge keys: most likely first, ties in input order
+def read_run(run, run_no):
+    run.seek(0)
+    for position, line in enumerate(run):
+        yield -float(line.split('\t', 1)[0]), run_no, position, line
+
+# Merges runs into one temporary file
+def merge_runs(runs, tmpdir):
+    merged = tempfile.TemporaryFile(mode='w+', buffering=IO_BUFFER, encoding='utf-8', dir=tmpdir)
+    for key in heapq.merge(*[read_run(run, run_no) for run_no, run in enumerate(runs)]):
+        merged.write(key[3])
+    for run in runs:
+        run.close()
+    return merged
+
+''' Sorts all records by probability (descending, stable), runs of chunk_size records are spilled to disk '''
+def sort_records(records, output, chunk_size, tmpdir, fan_in=FAN_IN):
+    runs = []
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        chunk.sort(key=lambda record: record[0], reverse=True)
+        if not runs and len(chunk) < chunk_size: # Fits into memory, no temporary files needed
+            output.writelines(format_record(record) for record in chunk)
+            return
+        if not chunk:
+            break
+        if len(runs) == fan_in-1: # Together with the merged run, at most fan_in files are open
+            runs = [merge_runs(runs, tmpdir)] # All earlier input, stays stable as the first run
+        run = tempfile.TemporaryFile(mode='w+', buffering=IO_BUFFER, encoding='utf-8', dir=tmpdir)
+        run.writelines(format_record(record) for record in chunk)
+        runs.append(run)
+    for key in heapq.merge(*[read_run(run, run_no) for run_no, run in enumerate(runs)]):
+        output.write(key[3])
+    for run in runs:
+        run.close()
+
+''' The k most likely (largest=True) or least likely records, in descending order, memory: k records '''
+def select_records(records, k, largest):
+    heap = []
+    if k <= 0:
+        return heap
+    for position, (prob, rest) in enumerate(records):
+        item = (prob, -position, rest) if largest else (-prob, position, rest) # Ties: as in the sorted output
+        if len(heap) < k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    if largest:
+        return [(prob, rest) for prob, position, rest in sorted(heap, reverse=True)]
+    return [(-prob, rest) for prob, position, rest in sorted(heap)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Sorts the strength meter outfile by likelihood (most likely first)")
+    parser.add_argument("result_file", help="result file of meter.py, - for stdin")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--top", type=int, metavar="K", help="only the K most likely passwords")
+    group.add_argument("--bottom", type=int, metavar="K", help="only the K least likely passwords")
+    parser.add_argument("--chunk-size", type=int, default=1000000, help="lines sorted in memory at once (default: 1000000)")
+    parser.add_argument("--tmpdir", default=None, help="directory of the temporary runs (default: system temp)")
+    parser.add_argument("--fan-in", type=int, default=None, help="temporary runs open at once (default: up to {}, below the limit of open files)".format(FAN_IN))
+    args = parser.parse_args()
+    fan_in = default_fan_in() if args.fan_in is None else args.fan_in
+    if fan_in < 2:
+        parser.error("--fan-in must be at least 2")
+
+    skipped = [0]
+    with open_text(args.result_file, 'r') as inputfile, open_text("-", 'w') as output:
+        if args.top is not None or args.bottom is not None:
+            records = read_records(inputfile, None, skipped)
+            output.writelines(format_record(record) for record in select_records(records, args.top if args.top is not None else args.bottom, args.top is not None))
+            sys.stderr.write("Skipped {} Info lines\n".format(skipped[0]))
+            return
+        with tempfile.TemporaryFile(mode='w+', buffering=IO_BUFFER, encoding='utf-8', dir=args.tmpdir) as info: # Separate bucket
+            sort_records(read_records(inputfile, info, skipped), output, args.chunk_size, args.tmpdir, fan_in)
+            info.seek(0)
+            for line in info:
+                output.write(line)
+
+if __name__ == '__main__':
+    main()